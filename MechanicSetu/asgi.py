@@ -12,6 +12,10 @@ django.setup()
 from channels.routing import ProtocolTypeRouter, URLRouter
 import jobs.routing
 from channels.auth import AuthMiddlewareStack
+from jobs.dispatcher import dispatcher
+
+# Start the job dispatcher so broadcasts interrupted by a restart are resumed
+dispatcher.start()
 
 # 4. Define your application
 application = ProtocolTypeRouter({
@@ -83,9 +83,16 @@ DATABASES = {
 }
 
 
+# Opt-in in-memory layer with a native group_send_many (see jobs.channel_layers);
+# jobs.fanout works the same on the stock layers, one group_send per group.
+CHANNEL_LAYERS_BULK = config("CHANNEL_LAYERS_BULK", default=False, cast=bool)
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": (
+            "jobs.channel_layers.BulkInMemoryChannelLayer" if CHANNEL_LAYERS_BULK
+            else "channels.layers.InMemoryChannelLayer"
+        )
     }
 }
 
@@ -110,6 +117,87 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# ----------------------
+# JOB DISPATCH
+# ----------------------
+DISPATCH_LEASE_SECONDS = 45       # a dispatcher must renew its lease on a job within this window
+DISPATCH_SCHEDULER_INTERVAL = 15  # how often leases are renewed and orphaned jobs are resumed
+DISPATCH_SIGNAL_POLL_INTERVAL = 2  # how often waiting waves read accepts, cancels and declines handled by other processes
+CHANNEL_FANOUT_CONCURRENCY = 32   # max concurrent channel-layer sends per fan-out
+LOCATION_FLUSH_INTERVAL = 5       # seconds between bulk writes of buffered mechanic positions
+JOB_ACTIVITY_FLUSH_INTERVAL = 30  # seconds between bulk writes of job heartbeat/activity timestamps
+TRAIL_FLUSH_INTERVAL = 30         # seconds between bulk inserts of active jobs' location trails
+
+# Server-side throttle for mechanic GPS streams (see jobs.location_filter).
+# Fixes closer than min_distance_m to the last accepted one are dropped until
+# max_interval passes; accepted fixes are capped at `rate`/s with bursts of `burst`.
+LOCATION_FILTER = {
+    'min_distance_m': 15,
+    'min_interval': 0.5,
+    'max_interval': 30,
+    'rate': 0.5,
+    'burst': 5,
+}
+
+# Live ETA pushed to customers with the mechanic's location (see jobs.eta).
+# An eta_update goes out at most every min_interval seconds, and only when the
+# estimate moved by min_change_seconds or min_change_ratio of the last one sent.
+ETA = {
+    'smoothing': 0.3,
+    'road_factor': 1.3,
+    'min_interval': 10,
+    'min_change_seconds': 60,
+    'min_change_ratio': 0.1,
+}
+
+# Per-connection outbound queue (see jobs.outbound). Queued locations/ETAs are
+# coalesced; a socket holding more than max_bytes for grace_seconds is closed (code 4008).
+WS_OUTBOUND = {
+    'max_bytes': 256 * 1024,
+    'grace_seconds': 15,
+}
+
+# Location cadence per subscriber (see jobs.outbound.LocationDownsampler), in
+# seconds; clients override it with ?location_interval= or 'set_location_rate'.
+LOCATION_STREAM = {
+    'default_interval': 0,
+    'observer_interval': 10,
+    'max_interval': 300,
+}
+
+# Approach/arrival detection on the location stream (see jobs.geofence).
+GEOFENCE = {
+    'approach_radius_m': 1000,
+    'arrival_radius_m': 75,
+    'arrival_fixes': 2,
+}
+
+# Search rings (km) per vehicle type. Each ring is only searched if nobody
+# in the previous rings accepted. Keys match ServiceRequest.vehical_type, case-insensitive.
+DISPATCH_RADIUS_RINGS = {
+    'default': [3, 7, 15, 30],
+}
+
+# Candidate ranking within a ring (see jobs.scoring). Lower score is offered first.
+DISPATCH_SCORING_WEIGHTS = {
+    'distance': 1.0,
+    'idle': 0.3,
+    'acceptance': 0.3,
+    'jobs_today': 0.2,
+}
+
+# Where offer leases live (see jobs.leases): 'local' for a single dispatcher
+# process, 'cache' to share them across processes through the Django cache.
+DISPATCH_OFFER_LEASES = 'local'
+
+# Micro-batching (see jobs.assignment): hold new jobs this many seconds and pick
+# each one's first offer jointly per area of this size. 0 disables batching.
+DISPATCH_BATCH_WINDOW = 0
+DISPATCH_BATCH_AREA_DEG = 0.1
+
+# Shared secret for scraping /api/jobs/DispatchMetrics/ (X-Metrics-Token header). Unset = disabled.
+DISPATCH_METRICS_TOKEN = os.getenv('DISPATCH_METRICS_TOKEN', '')
+
 SIMPLE_JWT = {
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': os.environ.get('SIGNING_KEY'),
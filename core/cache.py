@@ -1,4 +1,5 @@
 import functools
+import time
 from hashlib import md5
 from django.core.cache import cache
 # Make sure to import Response from DRF
@@ -6,12 +7,47 @@ from rest_framework.response import Response
 
 USER_CACHE_PREFIX = "user_cache"
 
-def make_cache_key(user_id, path):
+# A user's cached views live in a namespace numbered by a generation counter.
+# Invalidating the user bumps the counter, which orphans all of their keys at
+# once; the orphans then expire with their normal timeout.
+
+def _generation_key(user_id):
+    return f"{USER_CACHE_PREFIX}:gen:{user_id}"
+
+def get_user_generation(user_id):
+    """
+    The user's current cache generation. A missing counter (never set, or
+    culled) restarts from the clock rather than 0, so keys from before it
+    went missing can never match again.
+    """
+    key = _generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        fresh = time.time_ns()
+        generation = fresh if cache.add(key, fresh, None) else cache.get(key, fresh)
+    return generation
+
+def invalidate_user_cache(user_id):
     """
-    Always returns the same cache key for a given user and view path.
-    Works in both request-based and non-request contexts.
+    Invalidates every cached view of a user with a single increment. incr()
+    re-sets the key with the default timeout on some backends (DatabaseCache),
+    so the counter is made persistent again afterwards.
     """
-    base = f"{USER_CACHE_PREFIX}:{path}:user:{user_id}"
+    key = _generation_key(user_id)
+    try:
+        cache.incr(key)
+        cache.touch(key, None)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+def make_cache_key(user_id, path, generation=None):
+    """
+    Returns the cache key for a given user and view path in the user's
+    current generation. Works in both request-based and non-request contexts.
+    """
+    if generation is None:
+        generation = get_user_generation(user_id)
+    base = f"{USER_CACHE_PREFIX}:{path}:user:{user_id}:gen:{generation}"
     return md5(base.encode("utf-8")).hexdigest()
 
 def generate_user_cache_key(request):
@@ -39,13 +75,6 @@ def cache_per_user(timeout):
         def _wrapped_view(request, *args, **kwargs):
             cache_key = generate_user_cache_key(request)
 
-            # Track the cache key in a set for the user
-            if request.user.is_authenticated:
-                registry_key = f"user_cache_keys:{request.user.pk}"
-                keys = cache.get(registry_key) or set()
-                keys.add(cache_key)
-                cache.set(registry_key, keys, 6 * 60)  # 6 min registry
-
             # Try to get cached response data
             cached_payload = cache.get(cache_key)
             if cached_payload is not None:
@@ -75,8 +104,4 @@ def delete_all_user_cache(user):
     """
     Delete all cached views for a specific user.
     """
-    registry_key = f"user_cache_keys:{user.pk}"
-    keys = cache.get(registry_key) or set()
-    for key in keys:
-        cache.delete(key)
-    cache.delete(registry_key)  # clean up the registry itself
\ No newline at end of file
+    invalidate_user_cache(user.pk)
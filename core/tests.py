@@ -1,3 +1,62 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework.response import Response
+
+from users.models import CustomUser
+from .cache import _generation_key, cache_per_user, get_user_generation, invalidate_user_cache
+
+
+class PerUserCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(email='a@x.com')
+        self.other = CustomUser.objects.create(email='b@x.com')
+        self.calls = 0
+
+        @cache_per_user(60 * 5)
+        def view(request):
+            self.calls += 1
+            return Response({'calls': self.calls})
+
+        self.view = view
+
+    def get(self, user):
+        request = RequestFactory().get('/profile/')
+        request.user = user
+        return self.view(request).data['calls']
+
+    def later(self, seconds):
+        """Reads the DB cache as if `seconds` had passed."""
+        return mock.patch(
+            'django.core.cache.backends.db.tz_now', return_value=timezone.now() + timedelta(seconds=seconds)
+        )
+
+    def test_cached_response_misses_after_invalidation(self):
+        self.assertEqual(self.get(self.user), 1)
+        self.assertEqual(self.get(self.user), 1)
+        self.assertEqual(self.get(self.other), 2)
+
+        invalidate_user_cache(self.user.pk)
+
+        self.assertEqual(self.get(self.user), 3)
+        self.assertEqual(self.get(self.other), 2)
+
+    def test_generation_survives_past_the_cache_timeout(self):
+        generation = get_user_generation(self.user.pk)
+        invalidate_user_cache(self.user.pk)
+        self.assertEqual(get_user_generation(self.user.pk), generation + 1)
+        self.assertEqual(self.get(self.user), 1)
+
+        with self.later(60 * 60):
+            # The cached response has expired; the bumped counter has not.
+            self.assertEqual(cache.get(_generation_key(self.user.pk)), generation + 1)
+            self.assertEqual(self.get(self.user), 2)
+
+    def test_invalidating_a_user_without_a_generation(self):
+        invalidate_user_cache(self.user.pk)
+        self.assertIsNotNone(cache.get(_generation_key(self.user.pk)))
+        self.assertEqual(self.get(self.user), 1)
@@ -0,0 +1,98 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .flushing import PeriodicFlusher
+from .models import ServiceRequest
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'JOB_ACTIVITY_FLUSH_INTERVAL', 30)
+
+
+class JobActivityTracker(PeriodicFlusher):
+    """
+    Debounced "last activity" per job.
+
+    Heartbeats and location frames call `touch()`, which only records the time
+    in memory. At most once per `flush_interval` the touched jobs get their
+    `updated_at` set in a single UPDATE, instead of a full-row save() per frame.
+    The inactivity check allows for the interval (see `inactive_before()`).
+    """
+
+    thread_name = 'job-activity-flusher'
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        super().__init__(flush_interval)
+        self._pending = {}  # job_id -> last activity not yet written
+        self._latest = {}   # job_id -> last activity seen by this process
+
+    def touch(self, job_id):
+        now = timezone.now()
+        with self._lock:
+            self._pending[job_id] = self._latest[job_id] = now
+        if self._thread is None:
+            self.start()
+
+    def last_activity(self, job_id):
+        with self._lock:
+            return self._latest.get(job_id)
+
+    def inactive_before(self, cutoff):
+        """
+        The `updated_at` bound for jobs inactive since `cutoff`: activity may
+        sit unflushed for up to one interval, so the bound is pushed back by that much.
+        """
+        return cutoff - timezone.timedelta(seconds=self.flush_interval)
+
+    def forget(self, job_ids):
+        """Drops the activity of jobs that have ended."""
+        with self._lock:
+            for job_id in job_ids:
+                self._pending.pop(job_id, None)
+                self._latest.pop(job_id, None)
+
+    def flush(self):
+        """
+        Writes every pending touch in one UPDATE. Returns the number of jobs
+        touched. If the batch fails, each job is retried on its own and the
+        ones that still fail are dropped, so one bad id cannot block the rest.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            ServiceRequest.objects.filter(id__in=list(pending)).update(
+                updated_at=Case(
+                    *(When(id=job_id, then=Value(touched_at)) for job_id, touched_at in pending.items()),
+                    output_field=DateTimeField(),
+                )
+            )
+            logger.debug(f"[ACTIVITY] Flushed activity for {len(pending)} jobs.")
+            written = pending
+        except Exception as e:
+            logger.error(f"[ACTIVITY] Failed to flush activity for {len(pending)} jobs, retrying one by one: {e}", exc_info=True)
+            written = {}
+            for job_id, touched_at in pending.items():
+                try:
+                    ServiceRequest.objects.filter(id=job_id).update(updated_at=touched_at)
+                    written[job_id] = touched_at
+                except Exception as e:
+                    logger.error(f"[ACTIVITY] Dropping activity for job {job_id!r}: {e}")
+        self._prune(written)
+        return len(written)
+
+    def _prune(self, written):
+        # Written activity is in the DB now; keep only what was touched since.
+        with self._lock:
+            for job_id, touched_at in written.items():
+                if self._latest.get(job_id) == touched_at and job_id not in self._pending:
+                    del self._latest[job_id]
+
+
+# Process-wide tracker fed by JobNotificationConsumer.
+job_activity = JobActivityTracker()
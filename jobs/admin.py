@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ServiceRequest
+from .models import ServiceRequest, DispatchAttempt, JobTrailChunk
 
 @admin.register(ServiceRequest)
 class ServiceRequestAdmin(admin.ModelAdmin):
@@ -61,3 +61,27 @@ class ServiceRequestAdmin(admin.ModelAdmin):
     # Make foreign key fields searchable with a dropdown/search box
     raw_id_fields = ('user', 'assigned_mechanic')
 
+
+
+
+@admin.register(DispatchAttempt)
+class DispatchAttemptAdmin(admin.ModelAdmin):
+    """
+    Read-mostly view of persisted dispatch state, useful for spotting stuck broadcasts.
+    """
+    list_display = ('service_request', 'attempt', 'wave', 'next_deadline', 'owner', 'lease_expires_at', 'is_finished', 'updated_at')
+    list_filter = ('is_finished',)
+    search_fields = ('service_request__id', 'owner')
+    readonly_fields = ('timeline', 'updated_at')
+    raw_id_fields = ('service_request',)
+
+
+@admin.register(JobTrailChunk)
+class JobTrailChunkAdmin(admin.ModelAdmin):
+    """
+    Stored trail chunks; the encoded points themselves are served by the JobTrail endpoint.
+    """
+    list_display = ('service_request', 'started_at', 'point_count')
+    search_fields = ('service_request__id',)
+    exclude = ('data',)
+    raw_id_fields = ('service_request',)
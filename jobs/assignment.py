@@ -0,0 +1,155 @@
+import math
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from .models import ServiceRequest
+from .spatial_index import mechanic_index
+from .scoring import haversine_km, score_candidates, offer_stats, _load_workload
+from .leases import offer_leases
+from .tasks import get_dispatch_rings
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+AREA_DEG = getattr(settings, 'DISPATCH_BATCH_AREA_DEG', 0.1)  # ~11 km cells
+INFEASIBLE = 1e6  # cost of a pair outside the request's first search ring
+
+
+def linear_sum_assignment(cost):
+    """
+    Minimum-cost assignment of rows to columns (Hungarian algorithm, shortest
+    augmenting paths with potentials), O(n^2 m) with the inner loop vectorized.
+    Rectangular matrices are fine: every row (or column, if fewer) is matched.
+    Returns (row_indices, col_indices) sorted by row, like scipy's function.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty
+
+    # 1-based as in the classic formulation; index 0 is the virtual start column.
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)    # p[j]: row matched to column j (0 = none)
+    way = np.zeros(m + 1, dtype=int)  # previous column on the augmenting path
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (reduced < minv[1:])
+            minv[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Flip the augmenting path.
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.flatnonzero(p[1:])
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def area_key(latitude, longitude, area_deg=AREA_DEG):
+    return math.floor(latitude / area_deg), math.floor(longitude / area_deg)
+
+
+def build_cost_matrix(latitudes, longitudes, radii, candidate_ids, candidate_lats, candidate_lons):
+    """
+    Request x mechanic cost matrix using the same score as the per-request
+    ranking (jobs.scoring). Pairs beyond a request's radius cost INFEASIBLE.
+    """
+    distances = haversine_km(
+        np.asarray(latitudes)[:, None], np.asarray(longitudes)[:, None],
+        np.asarray(candidate_lats)[None, :], np.asarray(candidate_lons)[None, :],
+    )
+    radii = np.asarray(radii, dtype=float)[:, None]
+    jobs_today, idle_seconds = _load_workload(candidate_ids)
+    cost = score_candidates(
+        distances,
+        radii,
+        idle_seconds[None, :],
+        offer_stats.acceptance_rates(candidate_ids)[None, :],
+        jobs_today[None, :],
+        getattr(settings, 'DISPATCH_SCORING_WEIGHTS', None),
+    )
+    cost[distances > radii] = INFEASIBLE
+    return cost
+
+
+def _solve_area(requests):
+    """requests: [(job_id, latitude, longitude, radius)] in one area -> {job_id: user_id}."""
+    pool = {}
+    for _, latitude, longitude, radius in requests:
+        for user_id, m_lat, m_lon in zip(*mechanic_index.query_box(latitude, longitude, radius)):
+            pool[user_id] = (m_lat, m_lon)
+    # Mechanics already holding an offer are left to the broadcasts that leased them.
+    candidate_ids, _ = offer_leases.partition(list(pool), None)
+    if not candidate_ids:
+        return {}
+
+    cost = build_cost_matrix(
+        [request[1] for request in requests],
+        [request[2] for request in requests],
+        [request[3] for request in requests],
+        candidate_ids,
+        [pool[user_id][0] for user_id in candidate_ids],
+        [pool[user_id][1] for user_id in candidate_ids],
+    )
+    rows, cols = linear_sum_assignment(cost)
+    return {
+        requests[row][0]: candidate_ids[col]
+        for row, col in zip(rows, cols)
+        if cost[row, col] < INFEASIBLE
+    }
+
+
+def plan_first_offers(job_ids):
+    """
+    Chooses the mechanic to offer each job first, jointly for every PENDING
+    job in `job_ids`: jobs are grouped by area and each group is solved as one
+    assignment over the mechanics within the jobs' first search rings.
+    Returns {job_id: user_id}; jobs without a feasible mechanic are left out.
+    """
+    if not mechanic_index.is_warm:
+        mechanic_index.load_from_db()
+
+    areas = {}
+    rows = ServiceRequest.objects.filter(id__in=job_ids, status='PENDING').values_list(
+        'id', 'latitude', 'longitude', 'vehical_type'
+    )
+    for job_id, latitude, longitude, vehical_type in rows:
+        radius = get_dispatch_rings(vehical_type)[0]
+        areas.setdefault(area_key(latitude, longitude), []).append((job_id, latitude, longitude, radius))
+
+    plan = {}
+    for requests in areas.values():
+        if len(requests) > 1:
+            plan.update(_solve_area(requests))
+    logger.info(f"[Assignment] Planned first offers for {len(plan)} of {len(job_ids)} batched jobs in {len(areas)} areas.")
+    return plan
@@ -1,16 +1,29 @@
 import json
 from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from asgiref.sync import sync_to_async
 from users.models import Mechanic, CustomUser
 from rest_framework_simplejwt.tokens import AccessToken
 from channels.db import database_sync_to_async
 from .models import ServiceRequest
+from .location_buffer import location_buffer
+from .location_filter import location_filter
+from .ingest import forget_job, location_event, publish_location
+from .metrics import ws_outbound_total
+from .outbound import LocationDownsampler, OutboundQueue, location_stream_options, outbound_options
+from .fanout import job_group
+from .activity import job_activity
+from .dispatcher import dispatcher
+from .frames import (
+    LOCATION_SUBPROTOCOL, decode_location_update, encode_frame, encode_mechanic_location,
+    job_expired_frame, job_taken_frame, new_job_frame,
+)
 import logging
 
 # Set up a specific logger for this module
 logger = logging.getLogger(__name__)
 
+ACTIVE_JOB_STATUSES = ('ACCEPTED', 'ARRIVED')
+
 
 class JobNotificationConsumer(AsyncWebsocketConsumer):
     """
@@ -43,14 +56,50 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
 
         self.user_id = self.user.id
         self.personal_room_name = f'user_{self.user_id}'
-        self.job_room_name = None # To store the job-specific room name
+        self.job_room_name = None # job_{id} group of the active (or observed) job
+
+        # Per-connection session state, loaded once and then kept current by the
+        # lifecycle events pushed to this socket, so location frames need no DB reads.
+        self.role, self.mechanic_status, self.active_job_id, self.active_customer_id = (
+            await self.load_session_state(self.user_id)
+        )
+        self.active_destination = None  # (latitude, longitude) of the active job, loaded on first use
         
         await self.channel_layer.group_add(
             self.personal_room_name,
             self.channel_name
         )
+        if self.active_job_id is not None:
+            await self._join_job_room(self.active_job_id)
+
+        # Staff can follow a job's events as observers: ?observe=<job_id>
+        observe = query_params.get("observe", [None])[0]
+        is_observer = False
+        if observe and self.user.is_staff and self.active_job_id is None:
+            try:
+                await self._join_job_room(int(observe))
+                is_observer = True
+            except ValueError:
+                logger.warning(f"[WS-CONNECT] Ignoring invalid observe={observe!r} from user {self.user_id}.")
+
+        # Subscribers choose how often they get the mechanic's location:
+        # ?location_interval=<seconds>, or a 'set_location_rate' message later.
+        stream_options = location_stream_options()
+        self.location_stream = LocationDownsampler(
+            self._location_interval(
+                query_params.get("location_interval", [None])[0],
+                stream_options['observer_interval'] if is_observer else stream_options['default_interval'],
+            ),
+            self._send_location,
+        )
 
-        await self.accept()
+        # Clients offering the binary sub-protocol get location frames as structs (see jobs.frames).
+        self.binary_locations = LOCATION_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        await self.accept(subprotocol=LOCATION_SUBPROTOCOL if self.binary_locations else None)
+
+        # From here on, every send goes through a bounded queue (see send()).
+        self.outbound = OutboundQueue(self._write, **outbound_options())
+        self.outbound.start()
         logger.info(f"[WS-CONNECT] Accepted connection for user {self.user_id} and added to group '{self.personal_room_name}'.")
         
 
@@ -58,6 +107,11 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         """
         Handles a WebSocket disconnection.
         """
+        if getattr(self, 'outbound', None) is not None:
+            self.outbound.stop()
+        if getattr(self, 'location_stream', None) is not None:
+            self.location_stream.stop()
+
         # Discard from personal group
         if hasattr(self, 'personal_room_name'):
             await self.channel_layer.group_discard(
@@ -75,6 +129,29 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         logger.info(f"[WS-DISCONNECT] Disconnected user {getattr(self, 'user_id', 'N/A')}. Code: {close_code}")
 
 
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        """
+        Queues a frame on the connection's outbound queue instead of writing it
+        directly, so a slow client cannot hold up the consumer. Frames with a
+        `coalesce_key` replace a queued frame with the same key. A connection
+        that stays over its memory budget is closed.
+        """
+        outbound = getattr(self, 'outbound', None)
+        if outbound is None or close:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        if not outbound.put(text_data, bytes_data, coalesce_key):
+            logger.warning(
+                f"[WS-OUTBOUND] Closing connection of user {self.user_id}: "
+                f"{outbound.queued_bytes} bytes queued for over {outbound.grace_seconds}s."
+            )
+            ws_outbound_total.inc('over_budget_disconnect')
+            outbound.stop()
+            await self.close(code=4008)
+
+    async def _write(self, text_data, bytes_data):
+        await super().send(text_data=text_data, bytes_data=bytes_data)
+
     @database_sync_to_async
     def get_user_from_token(self, token_key):
         """
@@ -84,19 +161,101 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         try:
             validated_token = AccessToken(token_key)
             user_id = validated_token["user_id"]
-            user = CustomUser.objects.only('id', 'email').get(id=user_id)
+            user = CustomUser.objects.only('id', 'email', 'is_staff').get(id=user_id)
             logger.debug(f"Token validation successful for user_id: {user.id}")
             return user
         except Exception as e:
             logger.error(f"[TOKEN ERROR] Invalid token provided. Error: {e}", exc_info=False)
             return None
             
+    # --- Session State ---
+
+    async def _set_active_job(self, job_id, customer_id=None):
+        if self.active_job_id != int(job_id):
+            self.active_destination = None
+        self.active_job_id = int(job_id)
+        self.active_customer_id = customer_id
+        await self._join_job_room(self.active_job_id)
+
+    async def _clear_active_job(self, job_id):
+        if job_id is None:
+            return
+        if self.active_job_id == int(job_id):
+            forget_job(self.active_job_id)
+            self.active_job_id = None
+            self.active_customer_id = None
+            self.active_destination = None
+        await self._leave_job_room(job_id)
+
+    async def _join_job_room(self, job_id):
+        room_name = job_group(job_id)
+        if self.job_room_name == room_name:
+            return
+        if self.job_room_name:
+            await self.channel_layer.group_discard(self.job_room_name, self.channel_name)
+        await self.channel_layer.group_add(room_name, self.channel_name)
+        self.job_room_name = room_name
+
+    async def _leave_job_room(self, job_id):
+        if self.job_room_name == job_group(job_id):
+            await self.channel_layer.group_discard(self.job_room_name, self.channel_name)
+            self.job_room_name = None
+
+    async def is_active_job(self, job_id):
+        """
+        Whether `job_id` is this mechanic's active job. Answered from session
+        state; a job the connection has not heard of yet (e.g. accepted before
+        this socket connected) is verified against the DB once.
+        """
+        try:
+            job_id = int(job_id)
+        except (TypeError, ValueError):
+            return False
+        if job_id != self.active_job_id:
+            customer_id = await self.get_customer_id_for_job(job_id, self.user)
+            if customer_id is None:
+                return False
+            await self._set_active_job(job_id, customer_id)
+        return True
+
+    async def get_active_destination(self):
+        """
+        Where the active job is, for ETAs. Read from the DB once per job.
+        """
+        if self.active_destination is None and self.active_job_id is not None:
+            self.active_destination = await self.get_job_destination(self.active_job_id) or ()
+        return self.active_destination
+
+    async def session_state_update(self, event):
+        """
+        Internal event (see jobs.fanout.send_session_state) that refreshes the
+        connection's session state. Nothing is sent to the client.
+        """
+        if event.get('mechanic_status'):
+            self.role = 'mechanic'
+            self.mechanic_status = event['mechanic_status']
+        job_status = event.get('job_status')
+        if job_status in ACTIVE_JOB_STATUSES:
+            await self._set_active_job(event['job_id'], event.get('customer_id'))
+        elif job_status:
+            await self._clear_active_job(event.get('job_id'))
+
     # --- Incoming Message Router ---
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
-        Called whenever a message is received from a client.
+        Called whenever a message is received from a client. Binary messages
+        are location updates in the binary sub-protocol.
         """
+        if bytes_data is not None:
+            try:
+                data = decode_location_update(bytes_data)
+            except ValueError as e:
+                logger.warning(f"[WS-RECEIVE] Invalid binary frame from user {self.user_id}: {e}")
+                return
+            await self.handle_location_update(data)
+            return
+
         logger.info(f"[WS-RECEIVE] Received raw message from user {self.user_id}: {text_data}")
         try:
             data = json.loads(text_data)
@@ -110,6 +269,12 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
             # --- ADD THIS CONDITION ---
             elif message_type == 'user_heartbeat':
                 await self.handle_user_heartbeat(data)
+
+            elif message_type == 'job_declined':
+                await self.handle_job_declined(data)
+
+            elif message_type == 'set_location_rate':
+                await self.handle_set_location_rate(data)
             
             else:
                 logger.warning(f"[WS-RECEIVE] Unknown message type '{message_type}' from user {self.user_id}.")
@@ -144,19 +309,19 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
     async def new_job(self, event):
         """
         Handles the 'new_job' event from the channel layer.
+        The dispatcher sends the offer pre-encoded under 'frame'.
         """
         logger.info(f"[HANDLER] 'new_job' handler triggered for user {self.user_id}.")
+        if event.get('frame'):
+            await self.send(text_data=event['frame'])
+            return
+
         job_details = event.get('service_request')
         if not job_details:
             logger.warning(f"[HANDLER] 'new_job' event was missing 'service_request' data.")
             return
 
-        payload = {
-            'type': 'new_job',
-            'service_request': job_details
-        }
-        
-        await self.send(text_data=json.dumps(payload))
+        await self.send(text_data=encode_frame(new_job_frame(job_details)))
 
 
     async def job_expired_notification(self, event):
@@ -167,11 +332,7 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         job_id = event.get('job_id')
         logger.info(f"[HANDLER] 'job_expired_notification' triggered for user {self.user_id} regarding job {job_id}.")
         
-        await self.send(text_data=json.dumps({
-            'type': 'job_expired', # The type your frontend will look for
-            'job_id': job_id,
-            'message': f"The job request {job_id} has expired."
-        }))
+        await self.send(text_data=event.get('frame') or encode_frame(job_expired_frame(job_id)))
 
     # --- ADDED THIS NEW HANDLER ---
     async def job_taken_notification(self, event):
@@ -182,11 +343,7 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         job_id = event.get('job_id')
         logger.info(f"[HANDLER] 'job_taken_notification' triggered for user {self.user_id} regarding job {job_id}.")
         
-        await self.send(text_data=json.dumps({
-            'type': 'job_taken',  # The type your frontend will look for
-            'job_id': job_id,
-            'message': f"The job request {job_id} has been taken by another mechanic."
-        }))
+        await self.send(text_data=event.get('frame') or encode_frame(job_taken_frame(job_id)))
 
 
     async def mechanic_accepted(self, event):
@@ -194,6 +351,8 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         Informs the user that their request has been accepted and provides the job_id.
         """
         logger.info(f"[HANDLER] 'mechanic_accepted' handler triggered for user {self.user_id}.")
+        if event.get('job_id') is not None:
+            await self._set_active_job(event['job_id'])
         await self.send(text_data=json.dumps({
             'type': 'mechanic_accepted',
             'mechanic_details': event.get('mechanic_details'),
@@ -202,15 +361,54 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
 
     async def mechanic_location(self, event):
         """
-        Receives a location from the group and sends it to the client (the user).
+        Receives a location from the group and sends it to the client (the user)
+        at the rate the client asked for, followed by an 'eta_update' when the
+        event carries a new estimate.
+        """
+        if event.get('mechanic_id') == self.user_id:
+            return  # the mechanic's own position
+        # Geofence notices are one-off events, so they skip the downsampling.
+        for notice in event.get('geofence', ()):
+            await self.send(text_data=json.dumps({
+                'type': notice['notice'],
+                'job_id': event.get('job_id'),
+                'distance_m': notice['distance_m'],
+            }))
+        await self.location_stream.offer(event.get('mechanic_id'), event)
+
+    async def geofence_notice(self, event):
+        """
+        Tells the mechanic they appear to have arrived, so the app can prompt
+        them to mark the job as arrived.
         """
         await self.send(text_data=json.dumps({
-            'type': 'mechanic_location_update',
-            'latitude': event.get('latitude'),
-            'longitude': event.get('longitude'),
-            'mechanic_id': event.get('mechanic_id'),
+            'type': event['notice'],
+            'job_id': event.get('job_id'),
+            'distance_m': event.get('distance_m'),
+            'message': "You appear to have arrived. Mark the job as arrived?",
         }))
 
+    async def _send_location(self, event):
+        # Only the latest location and ETA are worth delivering to a client that is behind.
+        location_key = ('location', event.get('mechanic_id'))
+        if self.binary_locations:
+            await self.send(bytes_data=encode_mechanic_location(
+                event['latitude'], event['longitude'], event['mechanic_id'], int(event.get('job_id') or 0)
+            ), coalesce_key=location_key)
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'mechanic_location_update',
+                'latitude': event.get('latitude'),
+                'longitude': event.get('longitude'),
+                'mechanic_id': event.get('mechanic_id'),
+            }), coalesce_key=location_key)
+        if event.get('eta'):
+            await self.send(text_data=json.dumps({
+                'type': 'eta_update',
+                'job_id': event.get('job_id'),
+                **event['eta'],
+            }), coalesce_key=('eta', event.get('job_id')))
+
     async def job_cancelled_notification(self, event):
         """
         Handles the 'job_cancelled_notification' event.
@@ -219,6 +417,7 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         job_id = event.get('job_id')
         message = event.get('message')
         logger.info(f"[HANDLER] 'job_cancelled_notification' triggered for user {self.user_id} regarding job {job_id}.")
+        await self._clear_active_job(job_id)
 
         await self.send(text_data=json.dumps({
             'type': 'job_cancelled', # The type frontend will look for
@@ -251,6 +450,7 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
         job_id = event.get('job_id')
         message = event.get('message')
         logger.info(f"[HANDLER] 'job_completed_notification' triggered for user {self.user_id} regarding job {job_id}.")
+        await self._clear_active_job(job_id)
 
         await self.send(text_data=json.dumps({
             'type': 'job_completed', # The type frontend will look for
@@ -261,8 +461,10 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
 
     async def handle_location_update(self, data):
         """
-        Handles location updates. Always updates the DB.
-        Only sends to the customer if the mechanic is 'working' AND a job_id is provided.
+        Handles location updates. Fixes that pass the location filter are
+        recorded in the location buffer, which updates the dispatch index and
+        batches the DB write. Only sends to the job's group if the mechanic is
+        'working' AND a job_id is provided.
         """
         latitude = data.get('latitude')
         longitude = data.get('longitude')
@@ -274,47 +476,125 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
             logger.warning(f"Incomplete location data from user {self.user_id}.")
             return
 
-        # 1. Always update the mechanic's location in the database.
-        await self.update_mechanic_location(self.user_id, latitude, longitude)
+        try:
+            latitude, longitude = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid location data from user {self.user_id}.")
+            return
+
+        mechanic_is_working = self.role == 'mechanic' and self.mechanic_status == Mechanic.StatusChoices.WORKING
+
+        # 1. Drop jitter and bursts; a dropped fix still counts as job activity.
+        outcome = location_filter.check(self.user_id, latitude, longitude)
+        if outcome != 'accepted':
+            logger.debug(f"Mechanic {self.user_id} location {outcome}.")
+            if job_id and mechanic_is_working:
+                self.touch_job(job_id)
+            return
+
+        # 2. Record the mechanic's location (index now, DB on the next flush).
+        location_buffer.record(self.user_id, latitude, longitude)
         
-        logger.debug(f"Mechanic {self.user_id} location updated in DB: lat={latitude}, lon={longitude}.")
-        # 2. Only proceed to send a notification if there is a job_id.
+        logger.debug(f"Mechanic {self.user_id} location buffered: lat={latitude}, lon={longitude}.")
+        # 3. Only proceed to send a notification if there is a job_id.
         if not job_id:
-            logger.info(f"Mechanic {self.user_id} has no active job. DB location updated.")
+            logger.info(f"Mechanic {self.user_id} has no active job. Location buffered.")
             return # Exit early
 
-        # 3. Check the mechanic's status.
-        mechanic_is_working = await self.is_mechanic_working(self.user_id)
-
+        # 4. Check the mechanic's status (session state, no DB read).
         logger.info(f"Mechanic {self.user_id} is {'working' if mechanic_is_working else 'not working'}.")
-        # 4. If they are working, send the notification.
+        # 5. If they are working, send the notification.
         if mechanic_is_working:
 
-            customer_id = await self.get_customer_id_for_job(job_id, self.user)
-            await self.update_service_request_timestamp(job_id)
-            if customer_id:
-                target_room = f'user_{customer_id}'
-                logger.info(f"Sending mechanic location update to customer {customer_id} for job {job_id}.")
-                # This line will NOT cause an error if the customer is offline.
-                await self.channel_layer.group_send(
-                    target_room,
-                    {
-                        'type': 'mechanic_location',
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'mechanic_id': self.user_id,
-                        'job_id': job_id
-                    }
+            if await self.is_active_job(job_id):
+                self.touch_job(job_id)
+                logger.info(f"Sending mechanic location update to {self.job_room_name}.")
+                # Trail, ETA and geofence (see jobs.ingest), shared with the bulk upload endpoint.
+                event = location_event(
+                    self.user_id, self.active_job_id, latitude, longitude, await self.get_active_destination()
                 )
+                # The customer's devices and any observers; nobody listening is not an error.
+                await publish_location(self.channel_layer, event)
     async def handle_user_heartbeat(self, data):
         """
         Handles heartbeat messages from the user to keep a job active.
         """
         job_id = data.get('job_id')
         if job_id:
-            await self.update_service_request_timestamp(job_id)
+            self.touch_job(job_id)
+
+    def touch_job(self, job_id):
+        """
+        Marks the connection's active job as active. Only the job in session
+        state is touched, never an arbitrary id sent by the client. Debounced
+        in memory; `updated_at` is written by the activity flusher.
+        """
+        try:
+            job_id = int(job_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid job_id {job_id!r} in activity from user {self.user_id}.")
+            return
+        if job_id != self.active_job_id:
+            logger.debug(f"Ignoring activity for job {job_id} from user {self.user_id}: not their active job.")
+            return
+        job_activity.touch(job_id)
+
+    async def handle_set_location_rate(self, data):
+        """
+        Lets a subscriber change how often it receives the mechanic's location,
+        e.g. {'type': 'set_location_rate', 'interval': 30} when the app is backgrounded.
+        """
+        interval = self._location_interval(data.get('interval'), None)
+        if interval is None:
+            logger.warning(f"Invalid location interval {data.get('interval')!r} from user {self.user_id}.")
+            return
+        logger.info(f"User {self.user_id} set location interval to {interval}s.")
+        self.location_stream.set_interval(interval)
+
+    def _location_interval(self, value, default):
+        """Seconds between location frames, clamped to [0, max_interval]; `default` if unparseable."""
+        try:
+            interval = float(value)
+        except (TypeError, ValueError):
+            return default
+        if interval != interval:  # NaN
+            return default
+        return min(max(interval, 0), location_stream_options()['max_interval'])
+
+    async def handle_job_declined(self, data):
+        """
+        Handles a mechanic declining a job offer so the broadcast can move on
+        without waiting for the wave to time out.
+        """
+        try:
+            job_id = int(data.get('job_id'))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid job_id in 'job_declined' from user {self.user_id}.")
+            return
+        logger.info(f"Mechanic {self.user_id} declined job {job_id}.")
+        await database_sync_to_async(dispatcher.record_decline)(job_id, self.user_id)
        
     # --- Asynchronous Database Operations ---
+    @database_sync_to_async
+    def load_session_state(self, user_id):
+        """
+        Returns (role, mechanic_status, active_job_id, active_customer_id) for a
+        newly connected user.
+        """
+        mechanic = Mechanic.objects.filter(user_id=user_id).values_list('id', 'status').first()
+        if mechanic is None:
+            job_id = ServiceRequest.objects.filter(
+                user_id=user_id, status__in=ACTIVE_JOB_STATUSES
+            ).values_list('id', flat=True).first()
+            return 'customer', None, job_id, None
+
+        mechanic_id, mechanic_status = mechanic
+        job = ServiceRequest.objects.filter(
+            assigned_mechanic_id=mechanic_id, status__in=ACTIVE_JOB_STATUSES
+        ).values_list('id', 'user_id').first()
+        job_id, customer_id = job if job else (None, None)
+        return 'mechanic', mechanic_status, job_id, customer_id
+
     @database_sync_to_async
     def get_customer_id_for_job(self, job_id, mechanic_user):
         """
@@ -328,53 +608,13 @@ class JobNotificationConsumer(AsyncWebsocketConsumer):
             return job.user.id
         except ServiceRequest.DoesNotExist:
             return None
-        
 
     @database_sync_to_async
-    def is_mechanic_working(self, user_id):
+    def get_job_destination(self, job_id):
         """
-        Checks the database to see if the mechanic is marked as 'working'.
-        Returns True if the mechanic exists and is working, otherwise False.
+        Returns the (latitude, longitude) of a job, or None if it has no location.
         """
-        try:
-            mechanic = Mechanic.objects.get(user_id=user_id)
-            if mechanic.status==mechanic.StatusChoices.WORKING:
-                return True
-            else:
-                return False
-        except Mechanic.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def update_service_request_timestamp(self, job_id):
-        """
-        Updates the 'updated_at' field for a given service request.
-        """
-        try:
-            service_request = ServiceRequest.objects.get(id=job_id)
-            service_request.save() # This will automatically update the updated_at field
-            logger.info(f"Updated timestamp for service request {job_id}")
-        except ServiceRequest.DoesNotExist:
-            logger.warning(f"Could not update timestamp for non-existent service request {job_id}")
-
-
-    @sync_to_async
-    def update_mechanic_location(self, user_id, latitude, longitude):
-        """
-        Updates a mechanic's current location in the database.
-        Using .get() and .save() to ensure signals are triggered.
-        """
-        try:
-            mechanic = Mechanic.objects.get(user_id=user_id)
-            mechanic.current_latitude = latitude
-            mechanic.current_longitude = longitude
-            mechanic.save(update_fields=['current_latitude', 'current_longitude'])
-            
-            logger.info(f"Updated location for user {user_id} to ({latitude}, {longitude})")
-
-        except Mechanic.DoesNotExist:
-            logger.warning(f"Attempted to update location for non-existent mechanic user {user_id}")
-        except Exception as e:
-            logger.error(f"Error updating location for user {user_id}: {e}", exc_info=True)
-
-
+        destination = ServiceRequest.objects.filter(id=job_id).values_list('latitude', 'longitude').first()
+        if destination is None or None in destination:
+            return None
+        return destination
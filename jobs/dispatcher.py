@@ -0,0 +1,517 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DispatchAttempt
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = getattr(settings, 'DISPATCH_LEASE_SECONDS', 45)
+SCHEDULER_INTERVAL = getattr(settings, 'DISPATCH_SCHEDULER_INTERVAL', 15)
+# How often waiting waves pick up accepts, cancels and declines handled by other processes.
+SIGNAL_POLL_INTERVAL = getattr(settings, 'DISPATCH_SIGNAL_POLL_INTERVAL', 2)
+BATCH_WINDOW = getattr(settings, 'DISPATCH_BATCH_WINDOW', 0)
+MAX_TIMELINE_EVENTS = 200
+
+
+class DispatchLeaseLost(Exception):
+    """Raised when another dispatcher process has taken over a job."""
+
+
+def dispatch_time():
+    """
+    The dispatcher loop's clock: time.monotonic() in production, virtual time
+    under jobs.simulation. Falls back to time.monotonic() off the loop.
+    """
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
+
+
+class DispatchJob:
+    """
+    Lightweight in-memory state for one in-flight job.
+    The broadcast coroutine updates it as it moves through attempts and waves,
+    and checkpoints it to the job's DispatchAttempt row.
+    """
+    __slots__ = (
+        'job_id', 'owner', 'attempt', 'wave', 'batch', 'notified', 'deadline', 'created_at', 'task',
+        'status', 'assignee_id', 'declined', 'awaiting', 'changed', 'preferred', 'reserved',
+        'timeline', 'resumed',
+    )
+
+    def __init__(self, job_id, owner):
+        self.job_id = job_id
+        self.owner = owner
+        self.attempt = 0
+        self.wave = 0
+        self.batch = []      # mechanic user IDs in the open wave
+        self.notified = []   # mechanic user IDs offered the job in the current attempt
+        self.deadline = None  # dispatch_time() at which the current wave times out
+        self.created_at = None  # dispatch_time() when the job was spawned on the loop
+        self.task = None
+        # Job-state events published by the views (see Dispatcher.publish_job_state)
+        self.status = None
+        self.assignee_id = None
+        self.declined = set()
+        self.awaiting = set()  # mechanics in the current wave who have not declined
+        self.changed = asyncio.Event()
+        # Set by the batch assignment (see jobs.assignment)
+        self.preferred = None  # mechanic to offer the job first
+        self.reserved = set()  # mechanics planned as first offer for other jobs in the batch
+        self.timeline = []  # stage events, see log_event()
+        self.resumed = False
+
+    @classmethod
+    def from_attempt(cls, dispatch_attempt, owner):
+        """Rebuilds in-memory state from a persisted DispatchAttempt."""
+        job = cls(dispatch_attempt.service_request_id, owner)
+        job.attempt = dispatch_attempt.attempt
+        job.wave = dispatch_attempt.wave
+        job.batch = list(dispatch_attempt.wave_mechanic_ids or [])
+        job.notified = list(dispatch_attempt.notified_mechanic_ids or [])
+        job.declined = set(dispatch_attempt.declined_mechanic_ids or [])
+        job.timeline = list(dispatch_attempt.timeline or [])
+        job.resumed = True
+        if dispatch_attempt.next_deadline is not None:
+            remaining = (dispatch_attempt.next_deadline - timezone.now()).total_seconds()
+            job.deadline = dispatch_time() + max(0.0, remaining)
+        return job
+
+    def start_attempt(self, attempt):
+        self.attempt = attempt
+        self.wave = 0
+        self.batch = []
+        self.notified = []
+        self.deadline = None
+
+    def remaining(self):
+        """Seconds left in the current wave."""
+        if self.deadline is None:
+            return 0
+        return max(0.0, self.deadline - dispatch_time())
+
+    def log_event(self, stage, seconds=None, **detail):
+        """
+        Appends an event to the job's timeline. `t` is seconds since the job
+        reached this dispatcher (it restarts from 0 when a job is resumed).
+        """
+        if len(self.timeline) >= MAX_TIMELINE_EVENTS:
+            return
+        started = self.created_at if self.created_at is not None else dispatch_time()
+        event = {'t': round(dispatch_time() - started, 3), 'stage': stage}
+        if seconds is not None:
+            event['seconds'] = round(seconds, 4)
+        event.update(detail)
+        self.timeline.append(event)
+
+    def __repr__(self):
+        return f"<DispatchJob {self.job_id} attempt={self.attempt} wave={self.wave}>"
+
+    async def wait_for_response(self, batch_ids, timeout):
+        """
+        Waits until the job is accepted/cancelled, every mechanic in the wave
+        has declined, or `timeout` seconds pass. Returns True on an early wake-up.
+        """
+        self.awaiting = set(batch_ids) - self.declined
+        if self.status is not None or not self.awaiting:
+            return True
+        self.changed.clear()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def set_status(self, status, assignee_id=None):
+        self.status = status
+        self.assignee_id = assignee_id
+        self.changed.set()
+
+    def add_decline(self, user_id):
+        self.declined.add(user_id)
+        self.awaiting.discard(user_id)
+        if not self.awaiting:
+            self.changed.set()
+
+
+# --- Persistence Helpers ---
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=LEASE_SECONDS)
+
+def create_dispatch_attempt(job_id, owner):
+    """Creates (or re-claims) the DispatchAttempt row for a new job."""
+    attempt, created = DispatchAttempt.objects.get_or_create(
+        service_request_id=job_id,
+        defaults={'owner': owner, 'lease_expires_at': _lease_expiry()},
+    )
+    if not created:
+        claimed = DispatchAttempt.objects.filter(
+            Q(owner=owner) | Q(lease_expires_at__lt=timezone.now()) | Q(lease_expires_at__isnull=True),
+            pk=attempt.pk, is_finished=False,
+        ).update(owner=owner, lease_expires_at=_lease_expiry())
+        if not claimed:
+            return False
+    return True
+
+async def save_dispatch_progress(job):
+    """
+    Checkpoints the current wave. Raises DispatchLeaseLost if this process
+    no longer owns the job, so the caller stops before sending anything.
+    Only the wave and lease fields are written; the timeline is written once,
+    when the attempt finishes (see finish_dispatch_attempt).
+    """
+    remaining = job.remaining() if job.deadline is not None else None
+    await _save_dispatch_progress(job, remaining)
+
+@database_sync_to_async
+def _save_dispatch_progress(job, remaining):
+    next_deadline = timezone.now() + timedelta(seconds=remaining) if remaining is not None else None
+    updated = DispatchAttempt.objects.filter(
+        service_request_id=job.job_id, owner=job.owner, is_finished=False
+    ).update(
+        attempt=job.attempt,
+        wave=job.wave,
+        notified_mechanic_ids=job.notified,
+        wave_mechanic_ids=job.batch,
+        next_deadline=next_deadline,
+        lease_expires_at=_lease_expiry(),
+    )
+    if not updated:
+        raise DispatchLeaseLost(f"Lost dispatch lease for job {job.job_id}")
+
+@database_sync_to_async
+def finish_dispatch_attempt(job):
+    """
+    Marks the attempt finished and stores its timeline. A run cut short by a
+    crash never gets here, so a resumed job's timeline restarts at 'resumed'.
+    """
+    DispatchAttempt.objects.filter(
+        service_request_id=job.job_id, owner=job.owner
+    ).update(is_finished=True, next_deadline=None, lease_expires_at=None, timeline=job.timeline)
+
+def record_dispatch_decline(job_id, user_id):
+    """
+    Adds a decline to the job's DispatchAttempt, so whichever process owns
+    the job sees it (and a resumed attempt keeps it). Returns False if the
+    job is not being dispatched.
+    """
+    with transaction.atomic():
+        declined = DispatchAttempt.objects.select_for_update().filter(
+            service_request_id=job_id, is_finished=False
+        ).values_list('declined_mechanic_ids', flat=True).first()
+        if declined is None:
+            return False
+        if user_id not in declined:
+            DispatchAttempt.objects.filter(service_request_id=job_id).update(
+                declined_mechanic_ids=declined + [user_id]
+            )
+    return True
+
+@database_sync_to_async
+def read_dispatch_signals(job_ids):
+    """[(job_id, status, assignee_user_id, declined_user_ids), ...] for jobs being dispatched."""
+    return list(DispatchAttempt.objects.filter(service_request_id__in=job_ids).values_list(
+        'service_request_id', 'service_request__status',
+        'service_request__assigned_mechanic__user_id', 'declined_mechanic_ids',
+    ))
+
+@database_sync_to_async
+def renew_dispatch_leases(owner, job_ids):
+    if not job_ids:
+        return 0
+    return DispatchAttempt.objects.filter(
+        service_request_id__in=job_ids, owner=owner, is_finished=False
+    ).update(lease_expires_at=_lease_expiry())
+
+@database_sync_to_async
+def claim_orphaned_attempts(owner, limit=100):
+    """
+    Claims unfinished attempts whose lease has expired (their process died)
+    and returns them. The conditional UPDATE makes each claim exclusive
+    across dispatcher processes.
+    """
+    now = timezone.now()
+    expired = Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True)
+    candidate_ids = list(
+        DispatchAttempt.objects.filter(expired, is_finished=False)
+        .order_by('lease_expires_at')
+        .values_list('pk', flat=True)[:limit]
+    )
+    claimed = []
+    for pk in candidate_ids:
+        if DispatchAttempt.objects.filter(expired, pk=pk, is_finished=False).update(
+            owner=owner, lease_expires_at=_lease_expiry()
+        ):
+            claimed.append(DispatchAttempt.objects.get(pk=pk))
+    return claimed
+
+
+class Dispatcher:
+    """
+    One long-lived asyncio event loop, running in a dedicated daemon thread,
+    that drives the broadcast of every in-flight job in this process.
+
+    Views call `submit(job_id)` from any thread. Each job becomes a task on the
+    dispatcher loop; waiting for mechanic responses is just a timer, so a
+    burst of requests costs tasks, not OS threads. Database access goes
+    through `database_sync_to_async`, which runs on a single shared worker
+    thread and therefore a single connection.
+
+    Progress is checkpointed to DispatchAttempt under a renewable lease. A
+    periodic scheduler renews the leases of local jobs and claims attempts
+    whose owner stopped renewing (crash, deploy), resuming them at the saved
+    wave. Any number of processes can run a dispatcher against the same DB.
+
+    Accepts, cancels and declines end a waiting wave early. Those handled by
+    this process wake the wave directly (`publish_job_state`,
+    `record_decline`). Those handled by other processes are picked up by a
+    signal poller: one query every `signal_poll_interval` seconds
+    (settings.DISPATCH_SIGNAL_POLL_INTERVAL) reads the status and persisted
+    declines of every waiting job in this process.
+
+    With a `batch_window` (settings.DISPATCH_BATCH_WINDOW, seconds) new jobs
+    are held for that long and the first offer of every job in the batch is
+    chosen jointly, per area, by an assignment solver (jobs.assignment).
+    """
+
+    def __init__(self, loop_factory=None, batch_window=None, signal_poll_interval=None):
+        self._loop_factory = loop_factory or asyncio.new_event_loop
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._jobs = {}
+        self.batch_window = BATCH_WINDOW if batch_window is None else batch_window
+        self.signal_poll_interval = SIGNAL_POLL_INTERVAL if signal_poll_interval is None else signal_poll_interval
+        self._batch = []
+        self._batch_flush = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    # --- Lifecycle ---
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the dispatcher thread if it is not already running."""
+        with self._lock:
+            if self.is_running:
+                return
+            loop = self._loop_factory()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.create_task(self._scheduler())
+                if self.signal_poll_interval:
+                    loop.create_task(self._signal_poller())
+                loop.run_forever()
+
+            self._loop = loop
+            self._thread = threading.Thread(target=run, name='job-dispatcher', daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"[DISPATCHER] Dispatch loop started (worker {self.worker_id}).")
+
+    def stop(self, timeout=5):
+        """Cancels all in-flight jobs and stops the loop."""
+        with self._lock:
+            if not self.is_running:
+                return
+            loop, thread = self._loop, self._thread
+
+            async def shutdown():
+                # Jobs still waiting for the batch assignment stay unfinished and are resumed.
+                if self._batch_flush is not None:
+                    self._batch_flush.cancel()
+                for job in self._batch:
+                    self._jobs.pop(job.job_id, None)
+                self._batch, self._batch_flush = [], None
+                # In-flight jobs and the scheduler
+                tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                loop.stop()
+
+            asyncio.run_coroutine_threadsafe(shutdown(), loop)
+            thread.join(timeout)
+            self._loop = None
+            self._thread = None
+            logger.info("[DISPATCHER] Dispatch loop stopped.")
+
+    # --- Job management ---
+
+    def submit(self, job_id):
+        """
+        Enqueues a job for broadcasting. Safe to call from any synchronous
+        thread; the DispatchAttempt row is written before returning so the job
+        survives a restart. Submitting a job that is already in flight is a no-op.
+        """
+        self.start()
+        if not create_dispatch_attempt(job_id, self.worker_id):
+            logger.info(f"[DISPATCHER] Job {job_id} is owned by another dispatcher.")
+            return
+        self._loop.call_soon_threadsafe(self._spawn, DispatchJob(job_id, self.worker_id))
+
+    def _spawn(self, job):
+        if job.job_id in self._jobs:
+            logger.info(f"[DISPATCHER] Job {job.job_id} is already being dispatched.")
+            return
+        self._jobs[job.job_id] = job
+        job.created_at = self._loop.time()
+        job.log_event('resumed' if job.resumed else 'submitted', attempt=job.attempt, wave=job.wave)
+        if self.batch_window and not job.attempt:
+            # New job: hold it for the batch assignment. Resumed jobs go straight on.
+            self._batch.append(job)
+            if self._batch_flush is None:
+                self._batch_flush = self._loop.call_later(self.batch_window, self._flush_batch)
+            return
+        job.task = self._loop.create_task(self._run(job))
+
+    def _flush_batch(self):
+        jobs, self._batch, self._batch_flush = self._batch, [], None
+        self._loop.create_task(self._assign_batch(jobs))
+
+    async def _assign_batch(self, jobs):
+        """Plans the first offer of every batched job, then starts their broadcasts."""
+        from .assignment import plan_first_offers
+
+        try:
+            plan = await database_sync_to_async(plan_first_offers)([job.job_id for job in jobs])
+        except asyncio.CancelledError:
+            for job in jobs:
+                self._jobs.pop(job.job_id, None)
+            raise
+        except Exception as e:
+            logger.error(f"[DISPATCHER] Batch assignment failed, dispatching {len(jobs)} jobs greedily: {e}", exc_info=True)
+            plan = {}
+        planned = set(plan.values())
+        for job in jobs:
+            job.preferred = plan.get(job.job_id)
+            job.reserved = planned - {job.preferred}
+            job.task = self._loop.create_task(self._run(job))
+
+    async def _run(self, job):
+        # Imported here: tasks imports models, which must not load before apps are ready.
+        from .tasks import find_and_notify_mechanics
+
+        try:
+            await find_and_notify_mechanics(job)
+        except asyncio.CancelledError:
+            # Leave the attempt unfinished so it is resumed after the lease expires.
+            logger.info(f"[DISPATCHER] Dispatch of job {job.job_id} cancelled.")
+            raise
+        except DispatchLeaseLost:
+            logger.warning(f"[DISPATCHER] Job {job.job_id} was taken over by another dispatcher. Stopping.")
+            return
+        except Exception as e:
+            logger.critical(f"[DISPATCHER] Unexpected error dispatching job {job.job_id}: {e}", exc_info=True)
+        finally:
+            self._jobs.pop(job.job_id, None)
+        await finish_dispatch_attempt(job)
+
+    async def _scheduler(self):
+        """Renews local leases and resumes orphaned attempts, forever."""
+        while True:
+            try:
+                await renew_dispatch_leases(self.worker_id, list(self._jobs))
+                for dispatch_attempt in await claim_orphaned_attempts(self.worker_id):
+                    logger.info(
+                        f"[DISPATCHER] Resuming job {dispatch_attempt.service_request_id} "
+                        f"at attempt {dispatch_attempt.attempt}, wave {dispatch_attempt.wave}."
+                    )
+                    self._spawn(DispatchJob.from_attempt(dispatch_attempt, self.worker_id))
+            except Exception as e:
+                logger.error(f"[DISPATCHER] Scheduler error: {e}", exc_info=True)
+            await asyncio.sleep(SCHEDULER_INTERVAL)
+
+    async def _signal_poller(self):
+        """Applies accepts, cancels and declines recorded by other processes to waiting waves, forever."""
+        while True:
+            await asyncio.sleep(self.signal_poll_interval)
+            waiting = [job_id for job_id, job in self._jobs.items() if job.awaiting and job.status is None]
+            if not waiting:
+                continue
+            try:
+                for job_id, status, assignee_id, declined in await read_dispatch_signals(waiting):
+                    job = self._jobs.get(job_id)
+                    if job is None:
+                        continue
+                    for user_id in declined or ():
+                        if user_id not in job.declined:
+                            self._on_decline(job_id, user_id)
+                    if status not in (None, 'PENDING') and job.status is None:
+                        self._on_job_state(job_id, status, assignee_id)
+            except Exception as e:
+                logger.error(f"[DISPATCHER] Signal poll failed: {e}", exc_info=True)
+
+    def _call_on_loop(self, callback, *args):
+        """Runs `callback` on the dispatcher loop; a no-op if the loop is not running."""
+        loop = self._loop
+        if loop is None or not self.is_running:
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Loop closed between the check and the call.
+            pass
+
+    def publish_job_state(self, job_id, status, assignee_id=None):
+        """
+        Tells the waiting broadcast that a job left PENDING (accepted or
+        cancelled) so the current wave ends immediately. Safe from any thread.
+        A job owned by another process learns of it from the DB status through
+        that process's signal poller.
+        """
+        self._call_on_loop(self._on_job_state, job_id, status, assignee_id)
+
+    def record_decline(self, job_id, user_id):
+        """
+        Records that a mechanic declined an offer: persisted on the job's
+        DispatchAttempt for whichever process owns it, then applied directly
+        if that is this one. Synchronous (one DB write); safe from any thread.
+        """
+        if record_dispatch_decline(job_id, user_id):
+            self._call_on_loop(self._on_decline, job_id, user_id)
+
+    def _on_job_state(self, job_id, status, assignee_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        logger.info(f"[DISPATCHER] Job {job_id} is now {status}; waking broadcast.")
+        job.set_status(status, assignee_id)
+
+    def _on_decline(self, job_id, user_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.add_decline(user_id)
+
+    def get_job(self, job_id):
+        """The in-flight DispatchJob for job_id in this process, or None."""
+        return self._jobs.get(job_id)
+
+    def in_flight(self):
+        """Returns a snapshot of the jobs currently being dispatched."""
+        return list(self._jobs.copy().values())
+
+
+# Process-wide dispatcher used by the job views.
+dispatcher = Dispatcher()
@@ -0,0 +1,117 @@
+import threading
+import time
+import logging
+
+from django.conf import settings
+
+from .spatial_index import haversine_km
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_ETA = {
+    'smoothing': 0.3,          # EWMA weight of the newest speed sample
+    'initial_speed_kmh': 20,   # assumed until the mechanic has moved
+    'min_speed_kmh': 5,        # floor, so a stop in traffic does not send the ETA to infinity
+    'max_speed_kmh': 120,      # samples above this are GPS jumps and are ignored
+    'road_factor': 1.3,        # road distance / straight-line distance
+    'min_interval': 10,        # seconds between eta_update events for a job
+    'min_change_seconds': 60,  # an update must move the ETA by this much...
+    'min_change_ratio': 0.1,   # ...or by this fraction of the last sent ETA
+}
+
+
+class _EtaTrack:
+    __slots__ = ('latitude', 'longitude', 'seen_at', 'speed_kmh', 'sent_eta', 'sent_at')
+
+    def __init__(self, latitude, longitude, now, speed_kmh):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.seen_at = now
+        self.speed_kmh = speed_kmh
+        self.sent_eta = None
+        self.sent_at = None
+
+
+class EtaEngine:
+    """
+    Per-job arrival estimate fed by the mechanic's location stream.
+
+    Each fix updates an exponentially smoothed speed from the distance and time
+    since the previous fix, and the ETA is the remaining straight-line distance
+    (scaled by `road_factor`) over that speed. O(1) per fix; nothing is read
+    from the database. `update()` returns an estimate only when it is worth
+    pushing: at most every `min_interval` seconds and only on a material change.
+    """
+
+    def __init__(self, smoothing, initial_speed_kmh, min_speed_kmh, max_speed_kmh, road_factor,
+                 min_interval, min_change_seconds, min_change_ratio, clock=time.monotonic):
+        self.smoothing = smoothing
+        self.initial_speed_kmh = initial_speed_kmh
+        self.min_speed_kmh = min_speed_kmh
+        self.max_speed_kmh = max_speed_kmh
+        self.road_factor = road_factor
+        self.min_interval = min_interval
+        self.min_change_seconds = min_change_seconds
+        self.min_change_ratio = min_change_ratio
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tracks = {}  # job_id -> _EtaTrack
+
+    def update(self, job_id, latitude, longitude, destination_latitude, destination_longitude):
+        """
+        Feeds one fix. Returns {'eta_seconds', 'distance_km', 'speed_kmh'} when
+        an eta_update should be sent, otherwise None.
+        """
+        now = self.clock()
+        with self._lock:
+            track = self._tracks.get(job_id)
+            if track is None:
+                track = self._tracks[job_id] = _EtaTrack(latitude, longitude, now, self.initial_speed_kmh)
+            else:
+                self._observe_speed(track, latitude, longitude, now)
+
+            distance_km = haversine_km(latitude, longitude, destination_latitude, destination_longitude) * self.road_factor
+            eta = round(distance_km / max(track.speed_kmh, self.min_speed_kmh) * 3600)
+            if not self._should_send(track, eta, now):
+                return None
+            track.sent_eta, track.sent_at = eta, now
+            speed_kmh = track.speed_kmh
+
+        return {'eta_seconds': eta, 'distance_km': round(distance_km, 2), 'speed_kmh': round(speed_kmh, 1)}
+
+    def _observe_speed(self, track, latitude, longitude, now):
+        elapsed = now - track.seen_at
+        if elapsed <= 0:
+            return
+        sample = haversine_km(track.latitude, track.longitude, latitude, longitude) / (elapsed / 3600)
+        if sample <= self.max_speed_kmh:
+            track.speed_kmh += self.smoothing * (sample - track.speed_kmh)
+        track.latitude, track.longitude, track.seen_at = latitude, longitude, now
+
+    def _should_send(self, track, eta, now):
+        if track.sent_eta is None:
+            return True
+        if now - track.sent_at < self.min_interval:
+            return False
+        change = abs(eta - track.sent_eta)
+        return change >= self.min_change_seconds or change >= self.min_change_ratio * track.sent_eta
+
+    def forget(self, job_id):
+        """Drops a job's state once it is no longer active."""
+        with self._lock:
+            self._tracks.pop(job_id, None)
+
+    def job_ids(self):
+        with self._lock:
+            return set(self._tracks)
+
+
+def _build_engine():
+    options = dict(DEFAULT_ETA)
+    options.update(getattr(settings, 'ETA', {}))
+    return EtaEngine(**options)
+
+
+# Process-wide engine used by JobNotificationConsumer.
+eta_engine = _build_engine()
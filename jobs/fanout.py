@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+# Upper bound on channel-layer sends in flight at once for a single fan-out.
+FANOUT_CONCURRENCY = getattr(settings, 'CHANNEL_FANOUT_CONCURRENCY', 32)
+
+
+async def group_send_batch(channel_layer, sends, concurrency=None):
+    """
+    Sends many (group, message) pairs concurrently with bounded parallelism.
+    A failing recipient does not stop the others.
+    Returns {group: exception} for the sends that failed.
+    """
+    sends = list(sends)
+    if not sends:
+        return {}
+    semaphore = asyncio.Semaphore(concurrency or FANOUT_CONCURRENCY)
+
+    async def send_one(group, message):
+        async with semaphore:
+            await channel_layer.group_send(group, message)
+
+    results = await asyncio.gather(
+        *(send_one(group, message) for group, message in sends),
+        return_exceptions=True,
+    )
+    return {
+        group: result
+        for (group, _), result in zip(sends, results)
+        if isinstance(result, Exception)
+    }
+
+
+async def group_send_many(channel_layer, groups, message, concurrency=None):
+    """
+    Sends the same message to many groups.
+
+    Layers that list "group_send_many" in their `extensions` (see
+    jobs.channel_layers) get the whole list in one call; any other layer gets
+    one group_send per group, issued concurrently through group_send_batch.
+    Returns {group: exception} for the groups that failed.
+    """
+    groups = list(groups)
+    if not groups:
+        return {}
+    if 'group_send_many' in getattr(channel_layer, 'extensions', ()):
+        try:
+            return await channel_layer.group_send_many(groups, message) or {}
+        except Exception as e:
+            return {group: e for group in groups}
+    return await group_send_batch(channel_layer, ((group, message) for group in groups), concurrency)
+
+
+def user_groups(user_ids):
+    """Personal group names for a list of user IDs."""
+    return [f"user_{user_id}" for user_id in user_ids]
+
+
+def job_group(job_id):
+    """Group joined by every socket following a job: both parties and observers."""
+    return f"job_{job_id}"
+
+
+def log_fanout_failures(failures, description):
+    for group, error in failures.items():
+        logger.error(f"Failed to send {description} to {group}: {error}", exc_info=error)
+
+
+def send_session_state(user_id, **state):
+    """
+    Pushes a session-state change (mechanic_status, job_id, job_status,
+    customer_id) to a user's open sockets; see
+    JobNotificationConsumer.session_state_update. For synchronous code only.
+    """
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"user_{user_id}", {'type': 'session_state_update', **state}
+        )
+    except Exception as e:
+        logger.error(f"Failed to send session state to user_{user_id}: {e}", exc_info=True)
@@ -0,0 +1,55 @@
+import atexit
+import threading
+import logging
+
+from django.db import close_old_connections
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """
+    Base for in-memory write buffers: a daemon thread calls `flush()` every
+    `flush_interval` seconds, and once more on interpreter exit. Subclasses
+    implement `flush()` and call `start()` when they first buffer something.
+    """
+
+    thread_name = 'flusher'
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def flush(self):
+        raise NotImplementedError
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stops the flusher thread after a final flush."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.flush_interval + 5)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush_once()
+        self._flush_once()
+
+    def _flush_once(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"[{self.thread_name}] Flush failed: {e}", exc_info=True)
+        finally:
+            close_old_connections()
@@ -0,0 +1,98 @@
+import json
+import struct
+
+# --- Outbound WebSocket frames shared by the dispatcher and the consumer ---
+#
+# The dispatcher encodes each frame once and ships the text through the
+# channel layer under the 'frame' key; JobNotificationConsumer forwards it
+# verbatim instead of re-serializing per recipient.
+
+
+def new_job_frame(job_details):
+    return {
+        'type': 'new_job',
+        'service_request': job_details
+    }
+
+
+def job_expired_frame(job_id):
+    return {
+        'type': 'job_expired', # The type your frontend will look for
+        'job_id': job_id,
+        'message': f"The job request {job_id} has expired."
+    }
+
+
+def job_taken_frame(job_id):
+    return {
+        'type': 'job_taken',  # The type your frontend will look for
+        'job_id': job_id,
+        'message': f"The job request {job_id} has been taken by another mechanic."
+    }
+
+
+def encode_frame(frame):
+    """Serializes a frame to the exact text sent over the socket."""
+    return json.dumps(frame)
+
+
+# --- Binary location frames ---
+#
+# Clients that offer the LOCATION_SUBPROTOCOL WebSocket sub-protocol exchange
+# location traffic as fixed little-endian structs instead of JSON; every other
+# message stays JSON text. Coordinates are int32 in 1e-7 degrees (~1 cm), ids
+# are uint32 and a job_id of 0 means "no job".
+#
+#   location_update   (client -> server)  B kind=1, i lat, i lon, I job_id                  13 bytes
+#   mechanic_location (server -> client)  B kind=2, i lat, i lon, I mechanic_id, I job_id   17 bytes
+
+LOCATION_SUBPROTOCOL = 'mechanicsetu.location.v1'
+
+LOCATION_UPDATE_KIND = 1
+MECHANIC_LOCATION_KIND = 2
+
+_LOCATION_UPDATE = struct.Struct('<BiiI')
+_MECHANIC_LOCATION = struct.Struct('<BiiII')
+_COORDINATE_SCALE = 10_000_000
+
+
+def decode_location_update(data):
+    """
+    Parses a binary location_update into the same dict the JSON protocol
+    produces. Raises ValueError for anything else.
+    """
+    if len(data) != _LOCATION_UPDATE.size or data[0] != LOCATION_UPDATE_KIND:
+        raise ValueError(f"Not a binary location_update frame ({len(data)} bytes).")
+    _, lat, lon, job_id = _LOCATION_UPDATE.unpack(data)
+    return {
+        'type': 'location_update',
+        'latitude': lat / _COORDINATE_SCALE,
+        'longitude': lon / _COORDINATE_SCALE,
+        'job_id': job_id or None,
+    }
+
+
+def encode_location_update(latitude, longitude, job_id=None):
+    """Client side of the binary location_update, for tools and benchmarks."""
+    return _LOCATION_UPDATE.pack(
+        LOCATION_UPDATE_KIND, round(latitude * _COORDINATE_SCALE), round(longitude * _COORDINATE_SCALE), job_id or 0
+    )
+
+
+def encode_mechanic_location(latitude, longitude, mechanic_id, job_id=None):
+    return _MECHANIC_LOCATION.pack(
+        MECHANIC_LOCATION_KIND, round(latitude * _COORDINATE_SCALE), round(longitude * _COORDINATE_SCALE),
+        mechanic_id, job_id or 0
+    )
+
+
+def decode_mechanic_location(data):
+    """Client side of the binary mechanic_location, for tools and benchmarks."""
+    _, lat, lon, mechanic_id, job_id = _MECHANIC_LOCATION.unpack(data)
+    return {
+        'type': 'mechanic_location_update',
+        'latitude': lat / _COORDINATE_SCALE,
+        'longitude': lon / _COORDINATE_SCALE,
+        'mechanic_id': mechanic_id,
+        'job_id': job_id or None,
+    }
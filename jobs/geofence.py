@@ -0,0 +1,98 @@
+import threading
+import logging
+
+from django.conf import settings
+
+from .spatial_index import haversine_km
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEOFENCE = {
+    'approach_radius_m': 1000,  # 'mechanic_approaching' once the mechanic is this close
+    'arrival_radius_m': 75,     # 'arrival_suggested' once they stay this close...
+    'arrival_fixes': 2,         # ...for this many consecutive fixes (one noisy fix is not an arrival)
+}
+
+
+class _Fence:
+    __slots__ = ('latitude', 'longitude', 'approached', 'arrived', 'inside')
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.approached = False
+        self.arrived = False
+        self.inside = 0  # consecutive fixes within the arrival radius
+
+
+class GeofenceEngine:
+    """
+    Approach and arrival detection on the mechanic location stream.
+
+    Holds each active job's destination in memory, so evaluating a fix is one
+    distance computation and no database access. Each job emits
+    'mechanic_approaching' and 'arrival_suggested' at most once. State is per
+    process, like the rest of the location pipeline.
+    """
+
+    def __init__(self, approach_radius_m, arrival_radius_m, arrival_fixes):
+        self.approach_radius_km = approach_radius_m / 1000
+        self.arrival_radius_km = arrival_radius_m / 1000
+        self.arrival_fixes = arrival_fixes
+        self._lock = threading.Lock()
+        self._fences = {}  # job_id -> _Fence
+
+    def evaluate(self, job_id, latitude, longitude, destination):
+        """
+        Feeds one fix of `job_id`'s mechanic. `destination` is only read the
+        first time a job is seen. Returns the notices crossed by this fix,
+        e.g. [{'notice': 'mechanic_approaching', 'distance_m': 940}].
+        """
+        with self._lock:
+            fence = self._fences.get(job_id)
+            if fence is None:
+                fence = self._fences[job_id] = _Fence(*destination)
+            if fence.arrived:
+                return []
+
+            distance_km = haversine_km(latitude, longitude, fence.latitude, fence.longitude)
+            notices = []
+            if not fence.approached and distance_km <= self.approach_radius_km:
+                fence.approached = True
+                notices.append('mechanic_approaching')
+            fence.inside = fence.inside + 1 if distance_km <= self.arrival_radius_km else 0
+            if fence.inside >= self.arrival_fixes:
+                fence.arrived = True
+                notices.append('arrival_suggested')
+
+        distance_m = round(distance_km * 1000)
+        return [{'notice': notice, 'distance_m': distance_m} for notice in notices]
+
+    def mark_arrived(self, job_id):
+        """
+        The mechanic marked the job as arrived; nothing more to suggest. Only
+        for jobs verified as ARRIVED: the entry lives until the job ends (see
+        jobs.ingest.forget_job and the trail flush).
+        """
+        with self._lock:
+            fence = self._fences.setdefault(job_id, _Fence(None, None))
+            fence.approached = fence.arrived = True
+
+    def forget(self, job_id):
+        with self._lock:
+            self._fences.pop(job_id, None)
+
+    def job_ids(self):
+        with self._lock:
+            return set(self._fences)
+
+
+def _build_engine():
+    options = dict(DEFAULT_GEOFENCE)
+    options.update(getattr(settings, 'GEOFENCE', {}))
+    return GeofenceEngine(**options)
+
+
+# Process-wide engine used by the location pipeline (jobs.ingest).
+geofence_engine = _build_engine()
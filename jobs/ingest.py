@@ -0,0 +1,93 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .activity import job_activity
+from .eta import eta_engine
+from .fanout import job_group
+from .geofence import geofence_engine
+from .location_buffer import location_buffer
+from .location_filter import location_filter
+from .trail import trail_recorder
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+# --- Mechanic location ingestion shared by the WebSocket and HTTP paths ---
+
+
+def forget_job(job_id):
+    """Drops the in-memory state of a job that has ended."""
+    job_activity.forget([job_id])
+    eta_engine.forget(job_id)
+    geofence_engine.forget(job_id)
+
+
+def location_event(user_id, job_id, latitude, longitude, destination=None, t=None, notices=()):
+    """
+    Records an accepted fix on the job's trail and builds the job-group
+    'mechanic_location' event, with an ETA when it changed materially and
+    any geofence notices (see jobs.geofence) the fix crossed.
+    """
+    trail_recorder.record(job_id, latitude, longitude, t)
+    event = {
+        'type': 'mechanic_location',
+        'latitude': latitude,
+        'longitude': longitude,
+        'mechanic_id': user_id,
+        'job_id': job_id
+    }
+    if destination:
+        eta = eta_engine.update(job_id, latitude, longitude, *destination)
+        if eta:
+            event['eta'] = eta
+        notices = [*notices, *geofence_engine.evaluate(job_id, latitude, longitude, destination)]
+    if notices:
+        event['geofence'] = notices
+    return event
+
+
+async def publish_location(channel_layer, event):
+    """
+    Sends a location event to the job's group. An arrival suggestion also
+    goes to the mechanic, who is not sent their own location.
+    """
+    await channel_layer.group_send(job_group(event['job_id']), event)
+    for notice in event.get('geofence', ()):
+        if notice['notice'] == 'arrival_suggested':
+            await channel_layer.group_send(
+                f"user_{event['mechanic_id']}", {'type': 'geofence_notice', 'job_id': event['job_id'], **notice}
+            )
+
+
+def ingest_location_batch(user_id, points, job_id=None, destination=None):
+    """
+    Ingests fixes a mechanic app buffered while its socket was down:
+    [(latitude, longitude, unix_time), ...]. The batch is thinned by the
+    location filter, the whole of it goes onto the job's trail, and only the
+    latest fix moves the mechanic and is sent to the job's group. Pass
+    `job_id` only for the mechanic's verified active job. Returns the kept fixes.
+    """
+    kept = location_filter.thin(user_id, points)
+    if not kept:
+        return kept
+
+    latitude, longitude, t = kept[-1]
+    location_buffer.record(user_id, latitude, longitude)
+    if job_id is None:
+        return kept
+
+    job_activity.touch(job_id)
+    trail_recorder.record_many(job_id, kept[:-1])
+    notices = []
+    if destination:
+        # Approach/arrival may have happened while the socket was down.
+        for point in kept[:-1]:
+            notices.extend(geofence_engine.evaluate(job_id, point[0], point[1], destination))
+    event = location_event(user_id, job_id, latitude, longitude, destination, t, notices)
+    try:
+        async_to_sync(publish_location)(get_channel_layer(), event)
+    except Exception as e:
+        logger.error(f"[INGEST] Failed to send latest location of user {user_id} to job {job_id}: {e}", exc_info=True)
+    return kept
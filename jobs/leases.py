@@ -0,0 +1,129 @@
+import math
+import threading
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .dispatcher import dispatch_time
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+
+class LocalOfferLeaseRegistry:
+    """
+    In-process registry of open offers, timed on the dispatcher clock.
+
+    A mechanic holds at most one lease, for the job currently offered to
+    them; other jobs skip or deprioritise that mechanic until the lease is
+    released when the wave closes or its TTL runs out.
+    """
+
+    is_shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}   # user_id -> (job_id, expires_at)
+
+    def _holder_locked(self, user_id, now):
+        lease = self._leases.get(user_id)
+        if lease is None:
+            return None
+        if lease[1] <= now:
+            del self._leases[user_id]
+            return None
+        return lease[0]
+
+    def partition(self, user_ids, job_id):
+        """Splits user_ids into (free, leased_elsewhere), keeping their order."""
+        now = dispatch_time()
+        free, leased = [], []
+        with self._lock:
+            for user_id in user_ids:
+                holder = self._holder_locked(user_id, now)
+                (free if holder is None or holder == job_id else leased).append(user_id)
+        return free, leased
+
+    def acquire(self, user_ids, job_id, ttl):
+        """Leases every free mechanic in user_ids to job_id; returns those acquired."""
+        now = dispatch_time()
+        acquired = []
+        with self._lock:
+            for user_id in user_ids:
+                holder = self._holder_locked(user_id, now)
+                if holder is None or holder == job_id:
+                    self._leases[user_id] = (job_id, now + ttl)
+                    acquired.append(user_id)
+        return acquired
+
+    def release(self, job_id, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                lease = self._leases.get(user_id)
+                if lease is not None and lease[0] == job_id:
+                    del self._leases[user_id]
+
+    def holder(self, user_id):
+        with self._lock:
+            return self._holder_locked(user_id, dispatch_time())
+
+    def clear_job(self, job_id):
+        with self._lock:
+            for user_id in [u for u, (held, _) in self._leases.items() if held == job_id]:
+                del self._leases[user_id]
+
+
+class CacheOfferLeaseRegistry:
+    """
+    Offer leases shared by every process through the Django cache.
+    `cache.add` is atomic, so two dispatchers can never lease the same
+    mechanic at once. Methods do cache (DB) I/O; call them off the event loop.
+    """
+
+    is_shared = True
+
+    @staticmethod
+    def _lease_key(user_id):
+        return f"offer_lease:{user_id}"
+
+    def partition(self, user_ids, job_id):
+        holders = cache.get_many([self._lease_key(user_id) for user_id in user_ids])
+        free, leased = [], []
+        for user_id in user_ids:
+            holder = holders.get(self._lease_key(user_id))
+            (free if holder is None or holder == job_id else leased).append(user_id)
+        return free, leased
+
+    def acquire(self, user_ids, job_id, ttl):
+        acquired = []
+        for user_id in user_ids:
+            key = self._lease_key(user_id)
+            if cache.add(key, job_id, math.ceil(ttl)) or cache.get(key) == job_id:
+                acquired.append(user_id)
+        return acquired
+
+    def release(self, job_id, user_ids):
+        keys = [self._lease_key(user_id) for user_id in user_ids]
+        held = cache.get_many(keys)
+        cache.delete_many([key for key in keys if held.get(key) == job_id])
+
+    def holder(self, user_id):
+        return cache.get(self._lease_key(user_id))
+
+    def clear_job(self, job_id):
+        # Leases are released when their wave closes or expire with their TTL.
+        pass
+
+
+def _build_registry():
+    backend = getattr(settings, 'DISPATCH_OFFER_LEASES', 'local')
+    if backend == 'cache':
+        return CacheOfferLeaseRegistry()
+    if backend != 'local':
+        logger.warning(f"Unknown DISPATCH_OFFER_LEASES '{backend}', using the in-process registry.")
+    return LocalOfferLeaseRegistry()
+
+
+# Process-wide registry used by the dispatcher.
+offer_leases = _build_registry()
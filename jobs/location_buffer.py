@@ -0,0 +1,83 @@
+import logging
+
+from django.conf import settings
+
+from users.models import Mechanic
+from .flushing import PeriodicFlusher
+from .spatial_index import mechanic_index
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'LOCATION_FLUSH_INTERVAL', 5)
+
+
+class LocationBuffer(PeriodicFlusher):
+    """
+    Write-coalescing buffer for mechanic GPS updates.
+
+    `record()` keeps only the latest position per mechanic in memory and moves
+    them in the dispatch index straight away. A background thread writes the
+    positions that changed since the last flush with one `bulk_update` every
+    `flush_interval` seconds, so DB writes scale with the flush interval
+    rather than with mechanics x GPS rate. `bulk_update` sends no post_save
+    signals; nothing cached depends on a mechanic's live position.
+    """
+
+    thread_name = 'location-flusher'
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        super().__init__(flush_interval)
+        self._latest = {}        # user_id -> (latitude, longitude)
+        self._pending = {}       # user_id -> (latitude, longitude) not yet written
+        self._mechanic_ids = {}  # user_id -> Mechanic pk, for bulk_update
+
+    def record(self, user_id, latitude, longitude):
+        """Buffers a position update. Cheap enough to call on every frame."""
+        latitude, longitude = float(latitude), float(longitude)
+        with self._lock:
+            self._latest[user_id] = self._pending[user_id] = (latitude, longitude)
+        mechanic_index.move(user_id, latitude, longitude)
+        if self._thread is None:
+            self.start()
+
+    def get(self, user_id):
+        """The latest buffered (latitude, longitude) of a mechanic, or None."""
+        with self._lock:
+            return self._latest.get(user_id)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes every pending position in one bulk_update. Returns the number written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            missing = [user_id for user_id in pending if user_id not in self._mechanic_ids]
+            if missing:
+                self._mechanic_ids.update(
+                    Mechanic.objects.filter(user_id__in=missing).values_list('user_id', 'id')
+                )
+            mechanics = [
+                Mechanic(id=self._mechanic_ids[user_id], current_latitude=latitude, current_longitude=longitude)
+                for user_id, (latitude, longitude) in pending.items()
+                if user_id in self._mechanic_ids
+            ]
+            Mechanic.objects.bulk_update(mechanics, ['current_latitude', 'current_longitude'], batch_size=500)
+            logger.debug(f"[LOCATION] Flushed {len(mechanics)} mechanic positions.")
+            return len(mechanics)
+        except Exception as e:
+            logger.error(f"[LOCATION] Failed to flush {len(pending)} mechanic positions: {e}", exc_info=True)
+            with self._lock:
+                # Keep them for the next flush unless a newer position arrived meanwhile.
+                for user_id, position in pending.items():
+                    self._pending.setdefault(user_id, position)
+            return 0
+
+
+# Process-wide buffer fed by JobNotificationConsumer.
+location_buffer = LocationBuffer()
@@ -0,0 +1,128 @@
+import threading
+import time
+import logging
+
+from django.conf import settings
+
+from .metrics import location_frames_total
+from .spatial_index import haversine_km
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILTER = {
+    'min_distance_m': 15,  # a smaller move counts as GPS jitter
+    'min_interval': 0.5,   # seconds; never accept fixes closer together than this
+    'max_interval': 30,    # seconds; accept a stationary fix this often anyway, as a keepalive
+    'rate': 0.5,           # token bucket: sustained accepted fixes per second
+    'burst': 5,            # token bucket size
+}
+
+
+class _Track:
+    __slots__ = ('latitude', 'longitude', 'accepted_at', 'tokens', 'refilled_at')
+
+    def __init__(self, latitude, longitude, now, burst):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accepted_at = now
+        self.tokens = burst - 1
+        self.refilled_at = now
+
+
+class LocationFilter:
+    """
+    Server-side throttle for mechanic GPS streams.
+
+    A fix is accepted only if it is at least `min_interval` seconds after the
+    last accepted one and has moved `min_distance_m` from it (or `max_interval`
+    has passed, so a parked mechanic still shows as live). Accepted fixes then
+    spend a token from a per-mechanic bucket, which clamps bursts from apps
+    that replay queued fixes on reconnect. Only accepted fixes reach the
+    location buffer and the customer; every outcome is counted in
+    `jobs_location_frames_total`.
+    """
+
+    def __init__(self, min_distance_m, min_interval, max_interval, rate, burst, clock=time.monotonic):
+        self.min_distance_km = min_distance_m / 1000
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._tracks = {}  # user_id -> _Track
+
+    def check(self, user_id, latitude, longitude):
+        """
+        Returns 'accepted' or the reason the fix was dropped
+        ('dropped_interval', 'dropped_distance', 'dropped_rate').
+        """
+        now = self.clock()
+        with self._lock:
+            track = self._tracks.get(user_id)
+            if track is None:
+                self._tracks[user_id] = _Track(latitude, longitude, now, self.burst)
+                outcome = 'accepted'
+            else:
+                outcome = self._check_track(track, latitude, longitude, now)
+        location_frames_total.inc(outcome)
+        return outcome
+
+    def thin(self, user_id, points):
+        """
+        Applies the interval and distance rules to a batch of buffered fixes
+        [(latitude, longitude, unix_time), ...] by their own timestamps, with
+        no token bucket (a batch arrives in one request). Returns the kept
+        fixes, oldest first. The last kept fix becomes the mechanic's latest
+        accepted one, so the live stream continues from it.
+        """
+        kept = []
+        for latitude, longitude, t in sorted(points, key=lambda point: point[2]):
+            if kept:
+                last_lat, last_lon, last_t = kept[-1]
+                elapsed = t - last_t
+                if elapsed < self.min_interval:
+                    location_frames_total.inc('dropped_interval')
+                    continue
+                if elapsed < self.max_interval and haversine_km(last_lat, last_lon, latitude, longitude) < self.min_distance_km:
+                    location_frames_total.inc('dropped_distance')
+                    continue
+            kept.append((latitude, longitude, t))
+            location_frames_total.inc('accepted')
+        if kept:
+            now = self.clock()
+            with self._lock:
+                track = self._tracks.get(user_id)
+                if track is None:
+                    track = self._tracks[user_id] = _Track(kept[-1][0], kept[-1][1], now, self.burst)
+                track.latitude, track.longitude, track.accepted_at = kept[-1][0], kept[-1][1], now
+        return kept
+
+    def _check_track(self, track, latitude, longitude, now):
+        elapsed = now - track.accepted_at
+        if elapsed < self.min_interval:
+            return 'dropped_interval'
+        if elapsed < self.max_interval:
+            moved = haversine_km(track.latitude, track.longitude, latitude, longitude)
+            if moved < self.min_distance_km:
+                return 'dropped_distance'
+
+        track.tokens = min(self.burst, track.tokens + (now - track.refilled_at) * self.rate)
+        track.refilled_at = now
+        if track.tokens < 1:
+            return 'dropped_rate'
+        track.tokens -= 1
+
+        track.latitude, track.longitude, track.accepted_at = latitude, longitude, now
+        return 'accepted'
+
+
+def _build_filter():
+    options = dict(DEFAULT_FILTER)
+    options.update(getattr(settings, 'LOCATION_FILTER', {}))
+    return LocationFilter(**options)
+
+
+# Process-wide filter used by JobNotificationConsumer.
+location_filter = _build_filter()
@@ -0,0 +1,63 @@
+import logging
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from jobs.simulation import DispatchSimulation
+
+# Synthetic peak-hour scenarios: many requests arriving at once in a few hotspots.
+SCENARIOS = {
+    'hotspots': dict(mechanics=600, requests=600, clusters=3, cluster_sigma_km=1.5, arrival_window=120.0),
+    'single-hotspot': dict(mechanics=250, requests=400, clusters=1, cluster_sigma_km=2.0, arrival_window=60.0),
+    'citywide': dict(mechanics=1500, requests=1500, clusters=0, spread_km=15.0, arrival_window=180.0),
+}
+
+METRICS = [
+    'accepted', 'expiry_rate', 'time_to_first_offer_p50', 'time_to_accept_p50', 'time_to_accept_p90',
+    'accept_distance_km_p50', 'accept_distance_km_mean', 'offers_per_job', 'db_queries_per_job', 'wall_seconds',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares greedy per-request dispatch with micro-batched assignment on synthetic "
+        "peak-hour scenarios. Runs against a throwaway test database, flushed between runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append', help="Default: all scenarios.")
+        parser.add_argument('--batch-window', type=float, default=3.0, help="Seconds requests are held per batch.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _run(self, scenario, batch_window, seed):
+        call_command('flush', interactive=False, verbosity=0)
+        simulation = DispatchSimulation(seed=seed, batch_window=batch_window, **SCENARIOS[scenario])
+        simulation.setup()
+        return simulation.run()
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            logging.getLogger('jobs').setLevel(logging.ERROR)
+
+        old_name = connection.settings_dict['NAME']
+        self.stdout.write("Creating throwaway test database...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for scenario in options['scenario'] or sorted(SCENARIOS):
+                self._compare(scenario, options['batch_window'], options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _compare(self, scenario, batch_window, seed):
+        self.stdout.write(f"\n{scenario}: {SCENARIOS[scenario]}")
+        greedy = self._run(scenario, 0, seed)
+        batched = self._run(scenario, batch_window, seed)
+
+        self.stdout.write(f"{'':>26}  {'greedy':>10}  {'batched':>10}")
+        for key in METRICS:
+            cells = []
+            for report in (greedy, batched):
+                value = report.get(key)
+                cells.append('-' if value is None else f"{value:.3f}" if isinstance(value, float) else str(value))
+            self.stdout.write(f"{key:>26}  {cells[0]:>10}  {cells[1]:>10}")
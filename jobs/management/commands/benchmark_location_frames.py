@@ -0,0 +1,80 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from jobs.frames import (
+    decode_location_update, decode_mechanic_location, encode_location_update, encode_mechanic_location,
+)
+
+
+def _ws_header_bytes(payload_length, masked):
+    """RFC 6455 frame header size; client-to-server frames carry a 4-byte mask."""
+    size = 2 if payload_length < 126 else 4 if payload_length < 65536 else 10
+    return size + (4 if masked else 0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the JSON and binary (jobs.frames.LOCATION_SUBPROTOCOL) location frames: "
+        "bytes on the wire and CPU per frame for inbound location_update and outbound mechanic_location."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fixes = [
+            (12.9716 + rng.uniform(-0.3, 0.3), 77.5946 + rng.uniform(-0.3, 0.3), rng.randint(1, 500000), rng.randint(1, 10**6))
+            for _ in range(options['frames'])
+        ]
+
+        # Inbound: what the mechanic app sends and the consumer parses.
+        json_in = [
+            json.dumps({'type': 'location_update', 'latitude': lat, 'longitude': lon, 'job_id': job_id})
+            for lat, lon, job_id, _ in fixes
+        ]
+        binary_in = [encode_location_update(lat, lon, job_id) for lat, lon, job_id, _ in fixes]
+
+        rows = [
+            ('location_update json', json_in, True, lambda: [json.loads(frame) for frame in json_in], 'parse'),
+            ('location_update binary', binary_in, True, lambda: [decode_location_update(frame) for frame in binary_in], 'parse'),
+            (
+                'mechanic_location json',
+                [json.dumps({'type': 'mechanic_location_update', 'latitude': lat, 'longitude': lon, 'mechanic_id': mechanic_id})
+                 for lat, lon, _, mechanic_id in fixes[:1000]],
+                False,
+                lambda: [
+                    json.dumps({'type': 'mechanic_location_update', 'latitude': lat, 'longitude': lon, 'mechanic_id': mechanic_id})
+                    for lat, lon, _, mechanic_id in fixes
+                ],
+                'build',
+            ),
+            (
+                'mechanic_location binary',
+                [encode_mechanic_location(lat, lon, mechanic_id, job_id) for lat, lon, job_id, mechanic_id in fixes[:1000]],
+                False,
+                lambda: [encode_mechanic_location(lat, lon, mechanic_id, job_id) for lat, lon, job_id, mechanic_id in fixes],
+                'build',
+            ),
+        ]
+
+        # Sanity check: the binary codec round-trips within its 1e-7 degree resolution.
+        for (lat, lon, job_id, mechanic_id), frame in zip(fixes[:1000], binary_in):
+            decoded = decode_location_update(frame)
+            assert abs(decoded['latitude'] - lat) < 1e-7 and decoded['job_id'] == job_id
+            decoded = decode_mechanic_location(encode_mechanic_location(lat, lon, mechanic_id, job_id))
+            assert abs(decoded['longitude'] - lon) < 1e-7 and decoded['mechanic_id'] == mechanic_id
+
+        self.stdout.write(f"{options['frames']} frames per measurement\n")
+        self.stdout.write(f"{'':>26}  {'payload B':>10}  {'on wire B':>10}  {'us/frame':>10}")
+        for name, samples, masked, work, action in rows:
+            payload = sum(len(frame) for frame in samples) / len(samples)
+            wire = sum(len(frame) + _ws_header_bytes(len(frame), masked) for frame in samples) / len(samples)
+            started = time.perf_counter()
+            work()
+            per_frame_us = (time.perf_counter() - started) / len(fixes) * 1e6
+            self.stdout.write(f"{name:>26}  {payload:>10.1f}  {wire:>10.1f}  {per_frame_us:>7.2f} ({action})")
@@ -0,0 +1,152 @@
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+
+from .dispatcher import dispatch_time
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+# Seconds; covers both sub-millisecond index queries and multi-minute dispatches.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """
+    Cumulative-bucket latency histogram with one optional label, rendered in
+    the Prometheus text format. Thread-safe; observing is a bisect and three
+    additions under a lock.
+    """
+
+    def __init__(self, name, documentation, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_value, series in sorted(snapshot.items(), key=lambda item: str(item[0])):
+            labels = f'{self.label}="{label_value}"' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {series[-1]}')
+            suffix = f"{{{labels}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {series[-2]}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """
+    Monotonic counter with one optional label, rendered in the Prometheus text
+    format. Thread-safe.
+    """
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}  # label value -> count
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        with self._lock:
+            return self._values.get(label_value, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_value, count in sorted(snapshot.items(), key=lambda item: str(item[0])):
+            suffix = f'{{{self.label}="{label_value}"}}' if self.label else ''
+            lines.append(f"{self.name}{suffix} {count}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self._metrics.append(histogram)
+        return histogram
+
+    def counter(self, *args, **kwargs):
+        counter = Counter(*args, **kwargs)
+        self._metrics.append(counter)
+        return counter
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+# Per-process metrics, served by DispatchMetricsView.
+registry = MetricsRegistry()
+
+dispatch_stage_seconds = registry.histogram(
+    'jobs_dispatch_stage_seconds',
+    'Latency of each dispatch stage (candidate_query, serialization, fanout, wait, status_poll, outcome_fanout, expiry).',
+    label='stage',
+)
+time_to_first_offer_seconds = registry.histogram(
+    'jobs_dispatch_time_to_first_offer_seconds',
+    'From the job reaching the dispatcher to its first offer being sent.',
+)
+time_to_assignment_seconds = registry.histogram(
+    'jobs_dispatch_time_to_assignment_seconds',
+    'From the job reaching the dispatcher to a mechanic accepting it.',
+)
+
+location_frames_total = registry.counter(
+    'jobs_location_frames_total',
+    'Mechanic location frames by filter outcome (accepted, or dropped_interval / dropped_distance / dropped_rate).',
+    label='outcome',
+)
+
+ws_outbound_total = registry.counter(
+    'jobs_ws_outbound_total',
+    'WebSocket outbound events: coalesced (a queued frame replaced by a newer one), downsampled '
+    '(a held location replaced under a subscriber rate) and over_budget_disconnect.',
+    label='event',
+)
+
+
+@contextmanager
+def timed_stage(job, stage, **detail):
+    """
+    Times the body as one dispatch stage: observed in the stage histogram and
+    appended to the job's timeline. Yields `detail`, so the body can add to
+    what the timeline entry records (e.g. the number of candidates found).
+    """
+    started = dispatch_time()
+    try:
+        yield detail
+    finally:
+        elapsed = dispatch_time() - started
+        dispatch_stage_seconds.observe(elapsed, stage)
+        job.log_event(stage, elapsed, **detail)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0004_servicerequest_vehical_details'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispatchAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.PositiveSmallIntegerField(default=0)),
+                ('wave', models.PositiveSmallIntegerField(default=0)),
+                ('notified_mechanic_ids', models.JSONField(blank=True, default=list)),
+                ('next_deadline', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.CharField(blank=True, default='', max_length=100)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('is_finished', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('service_request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_attempt', to='jobs.servicerequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['is_finished', 'lease_expires_at'], name='jobs_dispat_is_fini_e6e411_idx')],
+            },
+        ),
+    ]
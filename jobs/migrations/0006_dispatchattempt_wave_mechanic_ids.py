@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0005_dispatchattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchattempt',
+            name='wave_mechanic_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0006_dispatchattempt_wave_mechanic_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispatchattempt',
+            name='timeline',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0007_dispatchattempt_timeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobTrailChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('service_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trail_chunks', to='jobs.servicerequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['service_request', 'started_at'], name='jobs_jobtra_service_ebae47_idx')],
+            },
+        ),
+    ]
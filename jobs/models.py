@@ -40,3 +40,59 @@ class ServiceRequest(models.Model):
     def __str__(self):
         return f"Request {self.id} for {self.vehical_type} by {self.user.email}"
     
+
+
+class DispatchAttempt(models.Model):
+    """
+    Persisted broadcast state for one ServiceRequest, so an in-flight dispatch
+    survives restarts and is owned by exactly one dispatcher process at a time.
+    """
+    service_request = models.OneToOneField(
+        ServiceRequest,
+        on_delete=models.CASCADE,
+        related_name='dispatch_attempt'
+    )
+    attempt = models.PositiveSmallIntegerField(default=0)
+    wave = models.PositiveSmallIntegerField(default=0)
+    notified_mechanic_ids = models.JSONField(default=list, blank=True) # user IDs offered the job in this attempt
+    wave_mechanic_ids = models.JSONField(default=list, blank=True) # user IDs in the currently open wave
+    declined_mechanic_ids = models.JSONField(default=list, blank=True) # user IDs who declined the job, from any process
+    next_deadline = models.DateTimeField(null=True, blank=True) # when the current wave times out
+    timeline = models.JSONField(default=list, blank=True) # stage events (see DispatchJob.log_event), written when the attempt finishes
+
+    # Lease: the dispatcher process currently driving this job
+    owner = models.CharField(max_length=100, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    is_finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_finished', 'lease_expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Dispatch of request {self.service_request_id} (attempt {self.attempt}, wave {self.wave})"
+
+
+class JobTrailChunk(models.Model):
+    """
+    A run of a job's mechanic GPS fixes, delta/varint-encoded (see jobs.trail).
+    Written in bulk while the job is ACCEPTED/ARRIVED; never updated.
+    """
+    service_request = models.ForeignKey(
+        ServiceRequest,
+        on_delete=models.CASCADE,
+        related_name='trail_chunks'
+    )
+    started_at = models.DateTimeField() # time of the chunk's first fix
+    point_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['service_request', 'started_at']),
+        ]
+
+    def __str__(self):
+        return f"Trail of request {self.service_request_id} from {self.started_at} ({self.point_count} points)"
@@ -0,0 +1,187 @@
+import asyncio
+import time
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import ws_outbound_total
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOUND = {
+    'max_bytes': 256 * 1024,  # queued bytes per connection before it counts as over budget
+    'grace_seconds': 15,      # how long a connection may stay over budget before it is dropped
+}
+
+DEFAULT_LOCATION_STREAM = {
+    'default_interval': 0,    # seconds between location frames to a subscriber; 0 = every fix
+    'observer_interval': 10,  # default for staff observing a job
+    'max_interval': 300,
+}
+
+
+class OutboundQueue:
+    """
+    Per-connection send queue drained by one writer task.
+
+    Frames sent with a `coalesce_key` (locations, ETAs) replace any queued
+    frame with the same key, so a slow client gets the latest position rather
+    than a backlog. Other frames (lifecycle events, offers) are never dropped
+    and are always written before coalesced ones. `put()` returns False once
+    the queue has stayed above `max_bytes` for `grace_seconds`; the caller
+    should then close the connection.
+    """
+
+    def __init__(self, send, max_bytes, grace_seconds, clock=time.monotonic):
+        self._send = send  # coroutine function(text_data, bytes_data)
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.clock = clock
+        self._priority = deque()  # (text_data, bytes_data)
+        self._coalesced = {}      # coalesce_key -> (text_data, bytes_data)
+        self._bytes = 0
+        self._over_since = None
+        self._ready = asyncio.Event()
+        self._task = None
+        self.closed = False
+
+    @property
+    def queued_bytes(self):
+        return self._bytes
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """Stops the writer and discards queued frames; later puts are dropped."""
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._priority.clear()
+        self._coalesced.clear()
+        self._bytes = 0
+
+    def put(self, text_data=None, bytes_data=None, coalesce_key=None):
+        if self.closed:
+            return True
+        frame = (text_data, bytes_data)
+        if coalesce_key is None:
+            self._priority.append(frame)
+        else:
+            replaced = self._coalesced.pop(coalesce_key, None)
+            if replaced is not None:
+                self._bytes -= _frame_size(replaced)
+                ws_outbound_total.inc('coalesced')
+            self._coalesced[coalesce_key] = frame
+        self._bytes += _frame_size(frame)
+        self._ready.set()
+        return self._check_budget()
+
+    def _check_budget(self):
+        if self._bytes <= self.max_bytes:
+            self._over_since = None
+            return True
+        now = self.clock()
+        if self._over_since is None:
+            self._over_since = now
+        return now - self._over_since < self.grace_seconds
+
+    def _pop(self):
+        if self._priority:
+            frame = self._priority.popleft()
+        else:
+            key = next(iter(self._coalesced))
+            frame = self._coalesced.pop(key)
+        self._bytes -= _frame_size(frame)
+        return frame
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._priority or self._coalesced:
+                text_data, bytes_data = self._pop()
+                self._check_budget()
+                try:
+                    await self._send(text_data, bytes_data)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[OUTBOUND] Send failed: {e}", exc_info=True)
+            self._ready.clear()
+
+
+class LocationDownsampler:
+    """
+    Delivers a subscriber at most one location per `interval` seconds per
+    mechanic, always the latest. A fix arriving inside the interval is held and
+    replaced by newer ones; whichever is newest goes out when the interval
+    ends. An ETA carried by a replaced event is kept on its replacement.
+    """
+
+    def __init__(self, interval, emit, clock=time.monotonic):
+        self.interval = interval
+        self._emit = emit  # coroutine function(event)
+        self.clock = clock
+        self._sent_at = {}  # key -> when the last event went out
+        self._held = {}     # key -> newest event not sent yet
+        self._timers = {}   # key -> asyncio.TimerHandle
+
+    async def offer(self, key, event):
+        now = self.clock()
+        last = self._sent_at.get(key)
+        if self.interval <= 0 or last is None or now - last >= self.interval:
+            self._held.pop(key, None)
+            self._sent_at[key] = now
+            await self._emit(event)
+            return
+        held = self._held.get(key)
+        if held is not None:
+            ws_outbound_total.inc('downsampled')
+            if 'eta' in held and 'eta' not in event:
+                event = {**event, 'eta': held['eta']}
+        self._held[key] = event
+        if key not in self._timers:
+            delay = self.interval - (now - last)
+            self._timers[key] = asyncio.get_running_loop().call_later(delay, self._release, key)
+
+    def _release(self, key):
+        self._timers.pop(key, None)
+        event = self._held.pop(key, None)
+        if event is not None:
+            self._sent_at[key] = self.clock()
+            asyncio.ensure_future(self._emit(event))
+
+    def set_interval(self, interval):
+        """Changes the cadence; anything held goes out now if the new one is shorter."""
+        shorter = interval < self.interval
+        self.interval = interval
+        if shorter:
+            for key, timer in list(self._timers.items()):
+                timer.cancel()
+                self._release(key)
+
+    def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._held.clear()
+
+
+def _frame_size(frame):
+    text_data, bytes_data = frame
+    return len(text_data) if text_data is not None else len(bytes_data)
+
+
+def outbound_options():
+    options = dict(DEFAULT_OUTBOUND)
+    options.update(getattr(settings, 'WS_OUTBOUND', {}))
+    return options
+
+
+def location_stream_options():
+    options = dict(DEFAULT_LOCATION_STREAM)
+    options.update(getattr(settings, 'LOCATION_STREAM', {}))
+    return options
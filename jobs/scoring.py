@@ -0,0 +1,156 @@
+import threading
+import time
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import ServiceRequest
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371
+
+# Lower score = offered first. Distance is normalized by the ring radius, the
+# other signals to [0, 1], so the weights are directly comparable.
+DEFAULT_WEIGHTS = {
+    'distance': 1.0,     # penalty: share of the ring radius
+    'idle': 0.3,         # bonus: time since the mechanic's last job (capped)
+    'acceptance': 0.3,   # bonus: recent acceptance rate
+    'jobs_today': 0.2,   # penalty: jobs already assigned today (capped)
+}
+IDLE_CAP_SECONDS = 4 * 60 * 60
+JOBS_TODAY_CAP = 8
+
+
+class MechanicOfferStats:
+    """
+    Per-process, exponentially decayed offer/accept counters per mechanic.
+    Fed by the dispatcher; read by the scorer as a recent acceptance rate.
+    """
+
+    def __init__(self, half_life=6 * 60 * 60):
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._stats = {}  # user_id -> [offers, accepts, updated_at]
+
+    def _decayed(self, user_id, now):
+        entry = self._stats.get(user_id)
+        if entry is None:
+            entry = self._stats[user_id] = [0.0, 0.0, now]
+            return entry
+        factor = 0.5 ** ((now - entry[2]) / self.half_life)
+        entry[0] *= factor
+        entry[1] *= factor
+        entry[2] = now
+        return entry
+
+    def record_offers(self, user_ids):
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                self._decayed(user_id, now)[0] += 1
+
+    def record_accept(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            self._decayed(user_id, now)[1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def acceptance_rates(self, user_ids):
+        """Smoothed accepts/offers; mechanics with no history get 0.5."""
+        now = time.monotonic()
+        rates = np.full(len(user_ids), 0.5)
+        with self._lock:
+            for i, user_id in enumerate(user_ids):
+                if user_id in self._stats:
+                    offers, accepts, _ = self._decayed(user_id, now)
+                    rates[i] = (accepts + 1) / (offers + 2)
+        return rates
+
+
+offer_stats = MechanicOfferStats()
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Vectorized great-circle distance from one point to arrays of points."""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def score_candidates(distances, radius, idle_seconds, acceptance_rates, jobs_today, weights=None):
+    """
+    Weighted score for every candidate in one vectorized pass. Lower is better.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    return (
+        weights['distance'] * (distances / np.maximum(radius, 1e-6))
+        - weights['idle'] * np.minimum(idle_seconds, IDLE_CAP_SECONDS) / IDLE_CAP_SECONDS
+        - weights['acceptance'] * acceptance_rates
+        + weights['jobs_today'] * np.minimum(jobs_today, JOBS_TODAY_CAP) / JOBS_TODAY_CAP
+    )
+
+
+def _load_workload(user_ids):
+    """
+    Jobs assigned today and the latest of their activity, for the given
+    mechanic user IDs, in one aggregate query.
+    Returns (jobs_today, idle_seconds) arrays aligned with user_ids.
+    """
+    now = timezone.now()
+    rows = ServiceRequest.objects.filter(
+        assigned_mechanic__user_id__in=user_ids,
+        created_at__gte=now - timedelta(days=1),
+    ).values('assigned_mechanic__user_id').annotate(
+        jobs=Count('id'), last_activity=Max('updated_at')
+    )
+    workload = {row['assigned_mechanic__user_id']: row for row in rows}
+
+    jobs_today = np.zeros(len(user_ids))
+    idle_seconds = np.full(len(user_ids), float(IDLE_CAP_SECONDS))
+    for i, user_id in enumerate(user_ids):
+        row = workload.get(user_id)
+        if row is not None:
+            jobs_today[i] = row['jobs']
+            idle_seconds[i] = (now - row['last_activity']).total_seconds()
+    return jobs_today, idle_seconds
+
+
+def rank_candidates(latitude, longitude, user_ids, latitudes, longitudes, radius, min_radius=0):
+    """
+    Filters raw candidates (e.g. from MechanicGridIndex.query_box) to the ring
+    min_radius < distance <= radius and returns their user IDs in broadcast
+    order, best first.
+    """
+    if not user_ids:
+        return []
+    distances = haversine_km(latitude, longitude, np.asarray(latitudes), np.asarray(longitudes))
+    in_ring = distances <= radius
+    if min_radius:
+        in_ring &= distances > min_radius
+    indices = np.flatnonzero(in_ring)
+    if not indices.size:
+        return []
+
+    ring_ids = [user_ids[i] for i in indices]
+    jobs_today, idle_seconds = _load_workload(ring_ids)
+    scores = score_candidates(
+        distances[indices],
+        radius,
+        idle_seconds,
+        offer_stats.acceptance_rates(ring_ids),
+        jobs_today,
+        getattr(settings, 'DISPATCH_SCORING_WEIGHTS', None),
+    )
+    return [ring_ids[i] for i in np.argsort(scores, kind='stable')]
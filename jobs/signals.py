@@ -1,8 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
+from django.db import transaction
 from users.models import Mechanic 
 from core.cache import make_cache_key 
+from .spatial_index import mechanic_index
+from .fanout import send_session_state
 
 # This function will be called every time a Mechanic model is saved.
 @receiver(post_save, sender=Mechanic)
@@ -20,4 +23,33 @@ def invalidate_mechanic_cache(sender, instance, **kwargs):
 
     # Delete the key
     cache.delete(cache_key_to_delete)
-    print(f"Deleted cache key: {cache_key_to_delete}")
\ No newline at end of file
+    print(f"Deleted cache key: {cache_key_to_delete}")
+
+
+@receiver(post_save, sender=Mechanic)
+def sync_mechanic_index(sender, instance, **kwargs):
+    """
+    Keeps the in-memory dispatch index in step with status, verification
+    and location changes.
+    """
+    mechanic_index.sync_mechanic(instance)
+
+
+@receiver(post_save, sender=Mechanic)
+def push_mechanic_status(sender, instance, update_fields=None, **kwargs):
+    """
+    Keeps the mechanic's open sockets' session state in step with their status.
+    """
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    transaction.on_commit(
+        lambda: send_session_state(instance.user_id, mechanic_status=instance.status)
+    )
+
+
+@receiver(post_delete, sender=Mechanic)
+def remove_mechanic_from_index(sender, instance, **kwargs):
+    """
+    Drops a deleted (e.g. rejected) mechanic from the dispatch index.
+    """
+    mechanic_index.remove(instance.user_id)
@@ -0,0 +1,352 @@
+import asyncio
+import json
+import math
+import random
+import time
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+
+from users.models import CustomUser, Mechanic
+from .models import ServiceRequest, DispatchAttempt
+from .dispatcher import Dispatcher, DispatchJob
+from .spatial_index import mechanic_index, haversine_km, KM_PER_DEGREE_LAT
+from .scoring import offer_stats
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop with a virtual clock. Whenever the loop would sleep waiting for
+    a timer, the clock jumps straight to that timer instead, so a 30 s wave
+    window costs no wall time.
+
+    Work in executor threads (database_sync_to_async) takes zero virtual time:
+    while any is in flight the loop blocks for real until it completes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._virtual_now = 0.0
+        self._executor_jobs = 0
+        real_select = self._selector.select
+
+        def virtual_select(timeout=None):
+            if self._executor_jobs or not timeout:
+                return real_select(timeout)
+            events = real_select(0)
+            if not events:
+                self._virtual_now += timeout
+            return events
+
+        self._selector.select = virtual_select
+
+    def time(self):
+        return self._virtual_now
+
+    def run_in_executor(self, executor, func, *args):
+        self._executor_jobs += 1
+        future = super().run_in_executor(executor, func, *args)
+        future.add_done_callback(self._executor_done)
+        return future
+
+    def _executor_done(self, _future):
+        self._executor_jobs -= 1
+
+
+class SimulatedMechanic:
+    __slots__ = ('user_id', 'mechanic_id', 'latitude', 'longitude', 'busy', 'offers')
+
+    def __init__(self, user_id, mechanic_id, latitude, longitude):
+        self.user_id = user_id
+        self.mechanic_id = mechanic_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.busy = False
+        self.offers = set()  # job IDs currently offered to this mechanic
+
+
+class SimulatedChannelLayer:
+    """
+    Stands in for the channel layer: every message addressed to user_{id} is
+    handed to the simulated mechanic (or customer) instead of a socket.
+    """
+
+    extensions = ["groups", "group_send_many"]
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+    async def group_send(self, group, message):
+        await self.group_send_many([group], message)
+
+    async def group_send_many(self, groups, message):
+        user_ids = [int(group.rsplit('_', 1)[1]) for group in groups]
+        self.simulation.deliver(user_ids, message)
+        return {}
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+class DispatchSimulation:
+    """
+    Drives the real dispatcher (jobs.dispatcher / jobs.tasks) against synthetic
+    mechanics and requests on a virtual clock.
+
+    Mechanics are placed in a disc (optionally in gaussian clusters) around
+    `center`. Each offer is answered after a lognormal latency: accepted with
+    `accept_probability`, declined with `decline_probability`, otherwise
+    ignored until the wave times out. Requests arrive uniformly over
+    `arrival_window` seconds. A non-zero `batch_window` runs the dispatcher
+    in micro-batching mode. Must run against a throwaway database
+    (see the simulate_dispatch management command).
+    """
+
+    def __init__(
+        self,
+        mechanics=2000,
+        requests=1000,
+        center=(23.0225, 72.5714),
+        spread_km=20.0,
+        clusters=0,
+        cluster_sigma_km=2.0,
+        arrival_window=300.0,
+        accept_probability=0.35,
+        decline_probability=0.15,
+        latency_median=8.0,
+        latency_sigma=0.6,
+        seed=42,
+        batch_window=0,
+    ):
+        self.num_mechanics = mechanics
+        self.num_requests = requests
+        self.center = center
+        self.spread_km = spread_km
+        self.clusters = clusters
+        self.cluster_sigma_km = cluster_sigma_km
+        self.arrival_window = arrival_window
+        self.accept_probability = accept_probability
+        self.decline_probability = decline_probability
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.random = random.Random(seed)
+
+        self.dispatcher = Dispatcher(loop_factory=VirtualClockEventLoop, batch_window=batch_window)
+        self.mechanics = {}     # user_id -> SimulatedMechanic
+        self.request_ids = []
+        self.request_positions = {}  # job_id -> (latitude, longitude)
+        self.arrivals = {}      # job_id -> virtual arrival time
+        self.first_offer = {}   # job_id -> virtual time of first new_job
+        self.accepted = {}      # job_id -> virtual time of acceptance
+        self.accepted_by = {}   # job_id -> mechanic user_id
+        self.offers = {}        # job_id -> number of offers sent
+        self.max_open_offers = 0  # most jobs offered to one mechanic at once
+        self.spawned = 0
+        self.queries = 0
+        self._count_queries = True
+
+    # --- Synthetic data ---
+
+    def _random_point(self, hotspots):
+        lat0, lon0 = self.center
+        if hotspots:
+            lat0, lon0 = self.random.choice(hotspots)
+            d_north = self.random.gauss(0, self.cluster_sigma_km)
+            d_east = self.random.gauss(0, self.cluster_sigma_km)
+        else:
+            r = self.spread_km * math.sqrt(self.random.random())
+            theta = self.random.uniform(0, 2 * math.pi)
+            d_north, d_east = r * math.cos(theta), r * math.sin(theta)
+        return (
+            lat0 + d_north / KM_PER_DEGREE_LAT,
+            lon0 + d_east / (KM_PER_DEGREE_LAT * math.cos(math.radians(lat0))),
+        )
+
+    def setup(self):
+        """Creates mechanics, a customer and PENDING requests with their DispatchAttempt rows."""
+        hotspots = [self._random_point(None) for _ in range(self.clusters)]
+
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(email=f"sim-mechanic-{i}@example.com") for i in range(self.num_mechanics)]
+        )
+        mechanics = []
+        for user in users:
+            latitude, longitude = self._random_point(hotspots)
+            mechanics.append(Mechanic(
+                user=user, shop_name='Sim', shop_address='Sim',
+                current_latitude=latitude, current_longitude=longitude,
+                is_verified=True, status=Mechanic.StatusChoices.ONLINE,
+            ))
+        for mechanic in Mechanic.objects.bulk_create(mechanics):
+            self.mechanics[mechanic.user_id] = SimulatedMechanic(
+                mechanic.user_id, mechanic.id, mechanic.current_latitude, mechanic.current_longitude
+            )
+
+        customer = CustomUser.objects.create(email='sim-customer@example.com')
+        requests = []
+        for _ in range(self.num_requests):
+            latitude, longitude = self._random_point(hotspots)
+            requests.append(ServiceRequest(
+                user=customer, latitude=latitude, longitude=longitude,
+                vehical_type='Car', status='PENDING',
+            ))
+        for request in ServiceRequest.objects.bulk_create(requests):
+            self.request_ids.append(request.id)
+            self.request_positions[request.id] = (request.latitude, request.longitude)
+
+        lease = timezone.now() + timedelta(days=1)
+        DispatchAttempt.objects.bulk_create([
+            DispatchAttempt(service_request_id=job_id, owner=self.dispatcher.worker_id, lease_expires_at=lease)
+            for job_id in self.request_ids
+        ])
+        mechanic_index.load_from_db()
+        offer_stats.clear()
+
+    # --- Simulated mechanic behaviour (runs on the dispatcher loop) ---
+
+    def deliver(self, user_ids, message):
+        message_type = message.get('type')
+        if message_type == 'new_job':
+            job_id = json.loads(message['frame'])['service_request']['id']
+            now = asyncio.get_running_loop().time()
+            self.first_offer.setdefault(job_id, now)
+            self.offers[job_id] = self.offers.get(job_id, 0) + len(user_ids)
+            for user_id in user_ids:
+                self._offer(self.mechanics[user_id], job_id)
+        elif message_type in ('job_taken_notification', 'job_expired_notification'):
+            job_id = int(message['job_id'])
+            for user_id in user_ids:
+                mechanic = self.mechanics.get(user_id)
+                if mechanic:
+                    mechanic.offers.discard(job_id)
+
+    def _offer(self, mechanic, job_id):
+        if mechanic.busy:
+            return
+        mechanic.offers.add(job_id)
+        self.max_open_offers = max(self.max_open_offers, len(mechanic.offers))
+        roll = self.random.random()
+        latency = self.random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+        loop = asyncio.get_running_loop()
+        if roll < self.accept_probability:
+            loop.call_later(latency, lambda: loop.create_task(self._accept(mechanic, job_id)))
+        elif roll < self.accept_probability + self.decline_probability:
+            loop.call_later(latency, self._decline, mechanic, job_id)
+
+    def _decline(self, mechanic, job_id):
+        if job_id in mechanic.offers:
+            mechanic.offers.discard(job_id)
+            self.dispatcher._on_decline(job_id, mechanic.user_id)
+
+    async def _accept(self, mechanic, job_id):
+        if mechanic.busy or job_id not in mechanic.offers:
+            return
+        mechanic.busy = True
+        if await self._accept_in_db(job_id, mechanic.mechanic_id):
+            self.accepted[job_id] = asyncio.get_running_loop().time()
+            self.accepted_by[job_id] = mechanic.user_id
+            mechanic_index.remove(mechanic.user_id)
+            self.dispatcher._on_job_state(job_id, 'ACCEPTED', mechanic.user_id)
+        else:
+            mechanic.busy = False
+
+    @database_sync_to_async
+    def _accept_in_db(self, job_id, mechanic_id):
+        # Same transition as AcceptServiceRequestView; not counted as dispatch queries.
+        self._count_queries = False
+        try:
+            return ServiceRequest.objects.filter(pk=job_id, status='PENDING').update(
+                status='ACCEPTED', assigned_mechanic_id=mechanic_id
+            ) > 0
+        finally:
+            self._count_queries = True
+
+    # --- Driver ---
+
+    def _query_counter(self, execute, sql, params, many, context):
+        if self._count_queries:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+    @database_sync_to_async
+    def _install_query_counter(self):
+        # The dispatcher's DB work all runs on this executor thread's connection.
+        connection.execute_wrappers.append(self._query_counter)
+
+    @database_sync_to_async
+    def _release_connection(self):
+        # Closed so the throwaway database can be dropped once the run is over.
+        connection.execute_wrappers.remove(self._query_counter)
+        connection.close()
+
+    def _spawn(self, job_id):
+        self.spawned += 1
+        self.dispatcher._spawn(DispatchJob(job_id, self.dispatcher.worker_id))
+
+    async def _schedule_arrivals(self):
+        await self._install_query_counter()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for job_id in self.request_ids:
+            arrival = start + self.random.uniform(0, self.arrival_window)
+            self.arrivals[job_id] = arrival
+            loop.call_at(arrival, self._spawn, job_id)
+
+    def run(self):
+        """Runs every request to completion and returns the report dict."""
+        previous_layer = channel_layers.set('default', SimulatedChannelLayer(self))
+        wall_start = time.perf_counter()
+        try:
+            self.dispatcher.start()
+            asyncio.run_coroutine_threadsafe(self._schedule_arrivals(), self.dispatcher._loop).result()
+            while self.spawned < len(self.request_ids) or self.dispatcher.in_flight():
+                time.sleep(0.02)
+            virtual_duration = self.dispatcher._loop.time()
+            asyncio.run_coroutine_threadsafe(self._release_connection(), self.dispatcher._loop).result()
+        finally:
+            self.dispatcher.stop()
+            channel_layers.set('default', previous_layer)
+        return self.report(virtual_duration, time.perf_counter() - wall_start)
+
+    def report(self, virtual_duration, wall_seconds):
+        statuses = dict.fromkeys(['ACCEPTED', 'EXPIRED', 'PENDING'], 0)
+        for status in ServiceRequest.objects.filter(id__in=self.request_ids).values_list('status', flat=True):
+            statuses[status] = statuses.get(status, 0) + 1
+        total = len(self.request_ids)
+        time_to_first_offer = [self.first_offer[j] - self.arrivals[j] for j in self.first_offer]
+        time_to_accept = [self.accepted[j] - self.arrivals[j] for j in self.accepted]
+        accept_distances = [
+            haversine_km(*self.request_positions[j], self.mechanics[u].latitude, self.mechanics[u].longitude)
+            for j, u in self.accepted_by.items()
+        ]
+        return {
+            'requests': total,
+            'mechanics': self.num_mechanics,
+            'accepted': statuses['ACCEPTED'],
+            'expired': statuses['EXPIRED'],
+            'expiry_rate': statuses['EXPIRED'] / total if total else 0,
+            'time_to_first_offer_p50': _percentile(time_to_first_offer, 50),
+            'time_to_first_offer_p90': _percentile(time_to_first_offer, 90),
+            'time_to_accept_p50': _percentile(time_to_accept, 50),
+            'time_to_accept_p90': _percentile(time_to_accept, 90),
+            'time_to_accept_p99': _percentile(time_to_accept, 99),
+            'accept_distance_km_p50': _percentile(accept_distances, 50),
+            'accept_distance_km_mean': sum(accept_distances) / len(accept_distances) if accept_distances else None,
+            'offers_per_job': sum(self.offers.values()) / total if total else 0,
+            'max_open_offers': self.max_open_offers,
+            'db_queries_per_job': self.queries / total if total else 0,
+            'virtual_seconds': virtual_duration,
+            'wall_seconds': wall_seconds,
+        }
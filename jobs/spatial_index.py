@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+import logging
+
+from users.models import Mechanic
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km. Same formula the ORM annotation used.
+    """
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(min(1.0, a)))
+
+
+class MechanicGridIndex:
+    """
+    In-memory uniform lat/lon grid of ONLINE, verified mechanics.
+
+    Each mechanic lives in exactly one cell keyed by (row, col). A radius query
+    only visits the cells overlapping the search box, so its cost depends on
+    local density rather than on the total number of online mechanics.
+
+    The index is per process. It is fed by Mechanic post_save/post_delete
+    signals (status, verification) and by live location updates from the
+    WebSocket consumer. Until it has been loaded from the database once it is
+    "cold" and callers should fall back to the ORM query.
+    """
+
+    def __init__(self, cell_size_deg=0.05, max_age=300):
+        self.cell_size_deg = cell_size_deg
+        # Full reload interval, guards against signals missed in other processes.
+        self.max_age = max_age
+        # Columns around the globe; cell columns wrap at the antimeridian.
+        self._columns = max(1, int(round(360 / cell_size_deg)))
+        self._lock = threading.RLock()
+        self._cells = {}      # (row, col) -> {user_id: (lat, lon)}
+        self._positions = {}  # user_id -> (row, col)
+        self._loaded_at = None
+
+    # --- Internal helpers ---
+
+    def _cell_for(self, latitude, longitude):
+        return (
+            int(math.floor(latitude / self.cell_size_deg)),
+            self._wrap_column(int(math.floor(longitude / self.cell_size_deg))),
+        )
+
+    def _wrap_column(self, col):
+        half = self._columns // 2
+        return (col + half) % self._columns - half
+
+    def _remove_locked(self, user_id):
+        cell = self._positions.pop(user_id, None)
+        if cell is None:
+            return
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(user_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def _put_locked(self, user_id, latitude, longitude):
+        self._remove_locked(user_id)
+        cell = self._cell_for(latitude, longitude)
+        self._cells.setdefault(cell, {})[user_id] = (latitude, longitude)
+        self._positions[user_id] = cell
+
+    # --- Public API ---
+
+    @property
+    def is_warm(self):
+        loaded_at = self._loaded_at
+        return loaded_at is not None and (time.monotonic() - loaded_at) < self.max_age
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, user_id):
+        return user_id in self._positions
+
+    def upsert(self, user_id, latitude, longitude):
+        """Adds a mechanic to the index or moves them to a new position."""
+        if latitude is None or longitude is None:
+            self.remove(user_id)
+            return
+        with self._lock:
+            self._put_locked(user_id, float(latitude), float(longitude))
+
+    def move(self, user_id, latitude, longitude):
+        """
+        Updates the position of a mechanic that is already indexed.
+        Location updates from mechanics that are not ONLINE are ignored.
+        """
+        if latitude is None or longitude is None:
+            return
+        with self._lock:
+            if user_id in self._positions:
+                self._put_locked(user_id, float(latitude), float(longitude))
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove_locked(user_id)
+
+    def sync_mechanic(self, mechanic):
+        """Applies the current state of a Mechanic instance to the index."""
+        if (
+            mechanic.status == Mechanic.StatusChoices.ONLINE
+            and mechanic.is_verified
+            and mechanic.current_latitude is not None
+            and mechanic.current_longitude is not None
+        ):
+            self.upsert(mechanic.user_id, mechanic.current_latitude, mechanic.current_longitude)
+        else:
+            self.remove(mechanic.user_id)
+
+    def load(self, rows):
+        """
+        Replaces the whole index with (user_id, latitude, longitude) rows.
+        """
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+            for user_id, latitude, longitude in rows:
+                if latitude is not None and longitude is not None:
+                    self._put_locked(user_id, float(latitude), float(longitude))
+            self._loaded_at = time.monotonic()
+        logger.info(f"Mechanic grid index loaded with {len(self._positions)} online mechanics.")
+
+    def load_from_db(self):
+        """Warms the index from the database with a single query."""
+        rows = Mechanic.objects.filter(
+            status=Mechanic.StatusChoices.ONLINE,
+            is_verified=True,
+            current_latitude__isnull=False,
+            current_longitude__isnull=False,
+        ).values_list('user_id', 'current_latitude', 'current_longitude')
+        self.load(list(rows))
+
+    def _box_cells(self, latitude, longitude, radius_km):
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+        lon_span = min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+        min_row = int(math.floor((latitude - lat_span) / self.cell_size_deg))
+        max_row = int(math.floor((latitude + lat_span) / self.cell_size_deg))
+        # Unwrapped column range; a box crossing the antimeridian continues on the other side.
+        min_col = int(math.floor((longitude - lon_span) / self.cell_size_deg))
+        max_col = int(math.floor((longitude + lon_span) / self.cell_size_deg))
+        if max_col - min_col + 1 >= self._columns:
+            min_col, max_col = 0, self._columns - 1
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                yield row, self._wrap_column(col)
+
+    def query_box(self, latitude, longitude, radius_km):
+        """
+        Returns (user_ids, latitudes, longitudes) for every mechanic in the
+        cells covering radius_km, without computing distances. Used by the
+        vectorized scorer (jobs.scoring), which filters and ranks in one pass.
+        """
+        user_ids, latitudes, longitudes = [], [], []
+        with self._lock:
+            cells = self._cells
+            for cell in self._box_cells(latitude, longitude, radius_km):
+                bucket = cells.get(cell)
+                if not bucket:
+                    continue
+                for user_id, (m_lat, m_lon) in bucket.items():
+                    user_ids.append(user_id)
+                    latitudes.append(m_lat)
+                    longitudes.append(m_lon)
+        return user_ids, latitudes, longitudes
+
+    def query_radius(self, latitude, longitude, radius_km, min_radius_km=0):
+        """
+        Returns [(distance_km, user_id), ...] with min_radius_km < distance <= radius_km,
+        nearest first. Only cells overlapping the outer radius are visited.
+        """
+        results = []
+        with self._lock:
+            cells = self._cells
+            for cell in self._box_cells(latitude, longitude, radius_km):
+                bucket = cells.get(cell)
+                if not bucket:
+                    continue
+                for user_id, (m_lat, m_lon) in bucket.items():
+                    distance = haversine_km(latitude, longitude, m_lat, m_lon)
+                    if distance <= radius_km and (distance > min_radius_km or not min_radius_km):
+                        results.append((distance, user_id))
+        results.sort()
+        return results
+
+
+# Process-wide index shared by the dispatcher, signals and WebSocket consumers.
+mechanic_index = MechanicGridIndex()
@@ -1,3 +1,770 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import math
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import CustomUser, Mechanic
+from .activity import JobActivityTracker
+from .assignment import linear_sum_assignment, plan_first_offers
+from .channel_layers import BulkInMemoryChannelLayer
+from .consumers import JobNotificationConsumer
+from .dispatcher import Dispatcher, DispatchJob, dispatch_time, record_dispatch_decline
+from .eta import EtaEngine, eta_engine
+from .fanout import group_send_many
+from .flushing import PeriodicFlusher
+from .geofence import GeofenceEngine
+from .ingest import forget_job
+from .location_filter import LocationFilter
+from .models import DispatchAttempt, JobTrailChunk, ServiceRequest
+from .outbound import LocationDownsampler, OutboundQueue
+from .serializers import MechanicDataForUserSerializer
+from .spatial_index import MechanicGridIndex, haversine_km, mechanic_index
+from .tasks import _execute_one_broadcast_pass, _query_nearby_mechanics, cancel_inactive_jobs_thread_task
+from .trail import TrailRecorder, decode_points, decode_stream, encode_points, frame_chunk, trail_recorder
+from .views import _mechanic_data_for_user
+
+# Along a meridian one degree of latitude is exactly this far (haversine radius 6371 km).
+KM_PER_DEGREE_MERIDIAN = 6371 * math.pi / 180
+
+
+# Tests flush buffers explicitly instead of through background threads.
+no_flusher_threads = mock.patch.object(PeriodicFlusher, 'start', lambda self: None)
+
+
+def create_mechanic(email, latitude=None, longitude=None, status=Mechanic.StatusChoices.ONLINE, is_verified=True):
+    user = CustomUser.objects.create(email=email)
+    return Mechanic.objects.create(
+        user=user, shop_name='Shop', shop_address='Address', status=status, is_verified=is_verified,
+        current_latitude=latitude, current_longitude=longitude,
+    )
+
+
+class MechanicGridIndexTests(TestCase):
+    CENTER = (12.9716, 77.5946)
+
+    def north_of_center(self, km):
+        return self.CENTER[0] + km / KM_PER_DEGREE_MERIDIAN, self.CENTER[1]
+
+    def test_query_radius_matches_orm_across_ring_edges(self):
+        distances = [0.5, 4.99, 5.01, 9.99, 10.01, 14.99, 15.01]
+        expected = {}
+        for i, km in enumerate(distances):
+            mechanic = create_mechanic(f'm{i}@x.com', *self.north_of_center(km))
+            expected[mechanic.user_id] = km
+        index = MechanicGridIndex()
+        index.load_from_db()
+
+        for min_radius, radius in [(0, 5), (5, 10), (10, 15)]:
+            from_index = [user_id for _, user_id in index.query_radius(*self.CENTER, radius, min_radius)]
+            self.assertEqual(from_index, _query_nearby_mechanics(*self.CENTER, radius, min_radius))
+            self.assertEqual(
+                from_index,
+                [user_id for user_id, km in expected.items() if min_radius < km <= radius],
+            )
+
+    def test_query_radius_crosses_the_antimeridian(self):
+        east = create_mechanic('east@x.com', 10.0, 179.99)
+        west = create_mechanic('west@x.com', 10.0, -179.99)
+        far = create_mechanic('far@x.com', 10.0, -179.5)
+        index = MechanicGridIndex()
+        index.load_from_db()
+
+        for latitude, longitude in [(10.0, 179.995), (10.0, -179.995)]:
+            found = [user_id for _, user_id in index.query_radius(latitude, longitude, 5)]
+            self.assertCountEqual(found, [east.user_id, west.user_id])
+            self.assertCountEqual(found, _query_nearby_mechanics(latitude, longitude, 5))
+        self.assertNotIn(far.user_id, found)
+        self.assertLess(haversine_km(10.0, 179.99, 10.0, -179.99), 5)
+
+    def test_status_signals_keep_index_in_sync(self):
+        mechanic_index.load([])
+        mechanic = create_mechanic('m@x.com', *self.CENTER)
+        self.assertIn(mechanic.user_id, mechanic_index)
+
+        mechanic.status = Mechanic.StatusChoices.OFFLINE
+        mechanic.save()
+        self.assertNotIn(mechanic.user_id, mechanic_index)
+        # Offline mechanics are not put back by location updates.
+        mechanic_index.move(mechanic.user_id, *self.CENTER)
+        self.assertNotIn(mechanic.user_id, mechanic_index)
+
+        mechanic.status = Mechanic.StatusChoices.ONLINE
+        mechanic.save()
+        self.assertIn(mechanic.user_id, mechanic_index)
+
+        mechanic.is_verified = False
+        mechanic.save()
+        self.assertNotIn(mechanic.user_id, mechanic_index)
+        mechanic.is_verified = True
+        mechanic.save()
+
+        mechanic_index.move(mechanic.user_id, *self.north_of_center(20))
+        self.assertEqual(mechanic_index.query_radius(*self.CENTER, 15), [])
+        self.assertEqual([user_id for _, user_id in mechanic_index.query_radius(*self.CENTER, 25)], [mechanic.user_id])
+
+        user_id = mechanic.user_id
+        mechanic.delete()
+        self.assertNotIn(user_id, mechanic_index)
+
+
+def brute_force_assignment_cost(cost):
+    rows, cols = cost.shape
+    if rows > cols:
+        return brute_force_assignment_cost(cost.T)
+    return min(
+        sum(cost[row, col] for row, col in enumerate(chosen))
+        for chosen in itertools.permutations(range(cols), rows)
+    )
+
+
+class LinearSumAssignmentTests(TestCase):
+
+    def assert_optimal(self, cost):
+        rows, cols = linear_sum_assignment(cost)
+        self.assertEqual(len(rows), min(cost.shape))
+        self.assertEqual(list(rows), sorted(rows))
+        self.assertEqual(len(set(rows)), len(rows))
+        self.assertEqual(len(set(cols)), len(cols))
+        self.assertAlmostEqual(cost[rows, cols].sum(), brute_force_assignment_cost(cost))
+
+    def test_known_answer(self):
+        cost = np.array([[4, 1, 3], [2, 0, 5], [3, 2, 2]], dtype=float)
+        rows, cols = linear_sum_assignment(cost)
+        self.assertEqual(list(rows), [0, 1, 2])
+        self.assertEqual(list(cols), [1, 0, 2])
+
+    def test_matches_brute_force_on_square_wide_and_tall_matrices(self):
+        rng = np.random.RandomState(7)
+        for shape in [(1, 1), (3, 3), (5, 5), (2, 5), (3, 6), (5, 2), (6, 3)]:
+            for _ in range(20):
+                with self.subTest(shape=shape):
+                    self.assert_optimal(rng.randint(0, 20, size=shape).astype(float))
+
+    def test_ties_and_infeasible_pairs(self):
+        self.assert_optimal(np.zeros((4, 4)))
+        self.assert_optimal(np.array([[1e6, 1.0], [2.0, 1e6], [3.0, 4.0]]))
+
+    def test_empty(self):
+        rows, cols = linear_sum_assignment(np.zeros((0, 3)))
+        self.assertEqual((len(rows), len(cols)), (0, 0))
+
+
+class PlanFirstOffersTests(TestCase):
+    BASE = (12.905, 77.55)  # every point below stays in one assignment area
+
+    def point(self, km_north):
+        return self.BASE[0] + km_north / KM_PER_DEGREE_MERIDIAN, self.BASE[1]
+
+    def create_job(self, customer, km_north):
+        latitude, longitude = self.point(km_north)
+        return ServiceRequest.objects.create(user=customer, status='PENDING', latitude=latitude, longitude=longitude)
+
+    def test_two_requests_competing_for_one_mechanic(self):
+        customer = CustomUser.objects.create(email='c@x.com')
+        # M1 is the nearest mechanic for both jobs, but it is the only one
+        # within job A's 3 km first ring; job B can also reach M2.
+        near = create_mechanic('m1@x.com', *self.point(2.5))
+        other = create_mechanic('m2@x.com', *self.point(6))
+        job_a = self.create_job(customer, 0)
+        job_b = self.create_job(customer, 4)
+        mechanic_index.load_from_db()
+
+        plan = plan_first_offers([job_a.id, job_b.id])
+
+        self.assertEqual(plan, {job_a.id: near.user_id, job_b.id: other.user_id})
+
+
+class TrailCodecTests(TestCase):
+
+    def assert_same_points(self, decoded, points):
+        self.assertEqual(len(decoded), len(points))
+        for (lat, lon, t), (exp_lat, exp_lon, exp_t) in zip(decoded, points):
+            self.assertAlmostEqual(lat, exp_lat, delta=0.5e-5)
+            self.assertAlmostEqual(lon, exp_lon, delta=0.5e-5)
+            self.assertEqual(t, int(exp_t))
+
+    def test_round_trip_negative_coordinates_and_out_of_order_timestamps(self):
+        points = [
+            (-33.8688, -151.2093, 1700000000),
+            (-33.86905, -151.20001, 1699999990.7),  # earlier than the first fix
+            (0.0, 0.0, 1700000100),
+            (89.99999, 179.99999, 1700000050),
+            (-89.99999, -179.99999, 1700000000),
+        ]
+        self.assert_same_points(decode_points(encode_points(points)), points)
+
+    def test_small_moves_cost_a_few_bytes_per_point(self):
+        points = [(12.9716 + i * 1e-4, 77.5946 - i * 1e-4, 1700000000 + i * 3) for i in range(100)]
+        self.assertLess(len(encode_points(points)), 5 * len(points))
+
+    def test_multi_chunk_stream(self):
+        first = [(12.9, 77.5, 1700000000), (12.91, 77.49, 1700000004)]
+        second = [(-1.5, -70.25, 1700000100)]
+        stream = frame_chunk(encode_points(first)) + frame_chunk(encode_points(second))
+        self.assert_same_points(decode_stream(stream), first + second)
+
+    @no_flusher_threads
+    def test_flush_writes_ordered_chunks_for_active_jobs_only(self):
+        customer = CustomUser.objects.create(email='c@x.com')
+        active = ServiceRequest.objects.create(user=customer, status='ACCEPTED')
+        ended = ServiceRequest.objects.create(user=customer, status='COMPLETED')
+        recorder = TrailRecorder(max_points=4)
+        points = [(12.9 + i * 1e-3, 77.5, 1700000000 + i) for i in range(10)]
+        recorder.record_many(active.id, points[5:])
+        recorder.record_many(active.id, points[:5])  # an upload that predates the live fixes
+        recorder.record(ended.id, 12.9, 77.5, 1700000000)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(recorder.flush(), 3)
+
+        chunks = JobTrailChunk.objects.order_by('started_at', 'id')
+        self.assertEqual([chunk.point_count for chunk in chunks], [4, 4, 2])
+        self.assertEqual({chunk.service_request_id for chunk in chunks}, {active.id})
+        self.assert_same_points(decode_stream(b''.join(frame_chunk(bytes(chunk.data)) for chunk in chunks)), points)
+        self.assertEqual(recorder.pending_points(active.id), [])
+
+
+class JobTrailViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = CustomUser.objects.create(email='c@x.com')
+        cls.outsider = CustomUser.objects.create(email='o@x.com')
+        cls.job = ServiceRequest.objects.create(user=cls.customer, status='ACCEPTED')
+        recorder = TrailRecorder(max_points=2)
+        cls.stored = [(12.9 + i * 1e-3, 77.5, 1700000000 + i) for i in range(5)]
+        with no_flusher_threads:
+            recorder.record_many(cls.job.id, cls.stored)
+        recorder.flush()
+
+    def setUp(self):
+        with no_flusher_threads:
+            trail_recorder.record(self.job.id, 13.0, 77.6, 1700000100)
+        self.addCleanup(trail_recorder.flush)
+
+    async def get_trail(self, user):
+        client = AsyncClient()
+        client.cookies['access'] = str(AccessToken.for_user(user))
+        return await client.get(f'/api/jobs/JobTrail/{self.job.id}/')
+
+    async def test_streams_stored_chunks_then_pending_fixes(self):
+        response = await self.get_trail(self.customer)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Trail-Format'], 'varint-delta-v1')
+        parts = [part async for part in response.streaming_content]
+        self.assertEqual(len(parts), 4)  # three stored chunks and the unflushed fix
+        points = decode_stream(b''.join(parts))
+        self.assertEqual(len(points), 6)
+        self.assertEqual(points[-1], (13.0, 77.6, 1700000100))
+
+    async def test_other_users_are_refused(self):
+        response = await self.get_trail(self.outsider)
+        self.assertEqual(response.status_code, 403)
+
+
+class CrossProcessDispatchSignalTests(TransactionTestCase):
+    """
+    The job is owned by this dispatcher; accepts and declines are written to
+    the DB as another process would, and must end the wave through the poller.
+    """
+
+    def setUp(self):
+        customer = CustomUser.objects.create(email='c@x.com')
+        self.first = create_mechanic('m1@x.com', 12.9, 77.5)
+        self.second = create_mechanic('m2@x.com', 12.9, 77.5)
+        self.request = ServiceRequest.objects.create(user=customer, status='PENDING', latitude=12.9, longitude=77.5)
+        DispatchAttempt.objects.create(service_request=self.request, owner='owner')
+        self.wave = [self.first.user_id, self.second.user_id]
+
+    def run_wave(self, elsewhere):
+        """Waits on a wave while `elsewhere` runs; returns (woke_early, job)."""
+        dispatcher = Dispatcher(signal_poll_interval=0.05)
+
+        async def scenario():
+            job = DispatchJob(self.request.id, 'owner')
+            dispatcher._jobs[job.job_id] = job
+            poller = asyncio.ensure_future(dispatcher._signal_poller())
+            waiting = asyncio.ensure_future(job.wait_for_response(self.wave, 10))
+            await asyncio.sleep(0)
+            await database_sync_to_async(elsewhere)()
+            try:
+                return await asyncio.wait_for(waiting, 2), job
+            finally:
+                poller.cancel()
+
+        return asyncio.run(scenario())
+
+    def test_declines_from_another_process_end_the_wave(self):
+        def decline_all():
+            for user_id in self.wave:
+                self.assertTrue(record_dispatch_decline(self.request.id, user_id))
+
+        woke_early, job = self.run_wave(decline_all)
+
+        self.assertTrue(woke_early)
+        self.assertEqual(job.declined, set(self.wave))
+        self.assertIsNone(job.status)
+
+    def test_accept_from_another_process_ends_the_wave(self):
+        def accept():
+            ServiceRequest.objects.filter(id=self.request.id).update(status='ACCEPTED', assigned_mechanic=self.second)
+
+        woke_early, job = self.run_wave(accept)
+
+        self.assertTrue(woke_early)
+        self.assertEqual((job.status, job.assignee_id), ('ACCEPTED', self.second.user_id))
+
+    def test_declines_are_persisted_once_and_survive_a_resume(self):
+        record_dispatch_decline(self.request.id, self.first.user_id)
+        record_dispatch_decline(self.request.id, self.first.user_id)
+        dispatch_attempt = DispatchAttempt.objects.get(service_request=self.request)
+        self.assertEqual(dispatch_attempt.declined_mechanic_ids, [self.first.user_id])
+        self.assertEqual(DispatchJob.from_attempt(dispatch_attempt, 'other').declined, {self.first.user_id})
+
+        DispatchAttempt.objects.filter(pk=dispatch_attempt.pk).update(is_finished=True)
+        self.assertFalse(record_dispatch_decline(self.request.id, self.second.user_id))
+
+
+class BroadcastRetryTests(TestCase):
+    """The second attempt offers the job again to everyone except those who declined."""
+
+    def run_attempts(self, ring_ids, declined_in_first):
+        job = DispatchJob(1, 'owner')
+        job.created_at = dispatch_time()
+        service_request = mock.Mock(id=1, latitude=12.9, longitude=77.5)
+        offered = []
+
+        async def send(channel_layer, groups, message):
+            offered.append([int(group.rsplit('_', 1)[1]) for group in groups])
+            return {}
+
+        async def close_wave(channel_layer, request_id, batch_ids, job):
+            job.declined.update(user_id for user_id in batch_ids if user_id in declined_in_first)
+            return False
+
+        async def scenario():
+            for attempt in (1, 2):
+                job.start_attempt(attempt)
+                offered.append(attempt)
+                self.assertFalse(await _execute_one_broadcast_pass(service_request, [3], 'frame', job))
+
+        with mock.patch('jobs.tasks.get_mechanics_in_ring', mock.AsyncMock(return_value=ring_ids)), \
+                mock.patch('jobs.tasks.save_dispatch_progress', mock.AsyncMock()), \
+                mock.patch('jobs.tasks.group_send_many', send), \
+                mock.patch('jobs.tasks._close_wave', close_wave):
+            asyncio.run(scenario())
+        return offered
+
+    def test_second_attempt_reoffers_everyone_who_did_not_decline(self):
+        offered = self.run_attempts([11, 12, 13], declined_in_first={12})
+
+        self.assertEqual(offered, [1, [11, 12, 13], 2, [11, 13]])
+
+
+class InactiveJobSweepTests(TestCase):
+    """
+    The sweeper runs in a Celery worker whose tracker is empty: it only sees
+    what the socket processes have flushed, up to one flush interval late.
+    """
+
+    def setUp(self):
+        self.customer = CustomUser.objects.create(email='c@x.com')
+        self.mechanic = create_mechanic('m@x.com', 12.9, 77.5, status=Mechanic.StatusChoices.WORKING)
+        self.tracker = JobActivityTracker(flush_interval=30)
+        patcher = mock.patch('jobs.tasks.job_activity', self.tracker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def accepted_job(self, idle):
+        job = ServiceRequest.objects.create(
+            user=self.customer, assigned_mechanic=self.mechanic, status='ACCEPTED', latitude=12.9, longitude=77.5,
+        )
+        ServiceRequest.objects.filter(id=job.id).update(updated_at=timezone.now() - idle)
+        return job
+
+    def assertStatus(self, job, status):
+        job.refresh_from_db()
+        self.assertEqual(job.status, status)
+
+    def test_job_touched_within_the_flush_interval_is_kept(self):
+        # Last flushed just past the threshold; the touch may still be unflushed elsewhere.
+        job = self.accepted_job(timedelta(minutes=15, seconds=20))
+        cancel_inactive_jobs_thread_task()
+        self.assertStatus(job, 'ACCEPTED')
+
+    def test_job_idle_past_the_threshold_is_cancelled(self):
+        job = self.accepted_job(timedelta(minutes=16))
+        cancel_inactive_jobs_thread_task()
+        self.assertStatus(job, 'CANCELLED')
+        self.mechanic.refresh_from_db()
+        self.assertEqual(self.mechanic.status, Mechanic.StatusChoices.ONLINE)
+
+    def test_activity_held_by_this_process_is_flushed_first(self):
+        job = self.accepted_job(timedelta(minutes=16))
+        with no_flusher_threads:
+            self.tracker.touch(job.id)
+        cancel_inactive_jobs_thread_task()
+        self.assertStatus(job, 'ACCEPTED')
+        self.assertIsNone(self.tracker.last_activity(job.id))
+
+
+class FakeClock:
+    """Monotonic clock the tests advance by hand."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class LocationFilterTests(TestCase):
+    STEP = 0.001  # degrees of latitude, ~111 m: always far enough to count as a move
+
+    def make_filter(self, **options):
+        self.clock = FakeClock()
+        config = dict(min_distance_m=15, min_interval=0.5, max_interval=30, rate=1, burst=3)
+        config.update(options)
+        return LocationFilter(clock=self.clock, **config)
+
+    def test_token_bucket_allows_a_burst_then_refills_at_the_rate(self):
+        location_filter = self.make_filter(min_interval=0)
+        outcomes = [location_filter.check(1, 12.9 + i * self.STEP, 77.5) for i in range(5)]
+        self.assertEqual(outcomes, ['accepted'] * 3 + ['dropped_rate'] * 2)
+
+        self.clock.advance(1)  # one token back
+        outcomes = [location_filter.check(1, 13.0 + i * self.STEP, 77.5) for i in range(2)]
+        self.assertEqual(outcomes, ['accepted', 'dropped_rate'])
+
+    def test_buckets_are_per_mechanic(self):
+        location_filter = self.make_filter(min_interval=0, burst=1)
+        self.assertEqual(location_filter.check(1, 12.9, 77.5), 'accepted')
+        self.assertEqual(location_filter.check(2, 12.9, 77.5), 'accepted')
+
+    def test_jitter_is_dropped_until_the_keepalive(self):
+        location_filter = self.make_filter()
+        self.assertEqual(location_filter.check(1, 12.9, 77.5), 'accepted')
+        self.clock.advance(0.2)
+        self.assertEqual(location_filter.check(1, 12.9 + self.STEP, 77.5), 'dropped_interval')
+        self.clock.advance(1)
+        self.assertEqual(location_filter.check(1, 12.90005, 77.5), 'dropped_distance')  # ~5 m
+        self.clock.advance(30)
+        self.assertEqual(location_filter.check(1, 12.90005, 77.5), 'accepted')
+
+    def test_thin_keeps_fixes_in_timestamp_order(self):
+        location_filter = self.make_filter()
+        points = [
+            (12.903, 77.5, 103.0),
+            (12.900, 77.5, 100.0),
+            (12.90001, 77.5, 101.0),  # jitter
+            (12.901, 77.5, 101.2),
+            (12.902, 77.5, 101.4),    # 0.2 s after the previous kept fix
+        ]
+        kept = location_filter.thin(1, points)
+        self.assertEqual(kept, [(12.900, 77.5, 100.0), (12.901, 77.5, 101.2), (12.903, 77.5, 103.0)])
+
+        # The live stream continues from the last kept fix.
+        self.clock.advance(1)
+        self.assertEqual(location_filter.check(1, 12.903, 77.5), 'dropped_distance')
+
+
+class OutboundQueueTests(TestCase):
+
+    def make_queue(self, max_bytes=1024, grace_seconds=15):
+        self.clock = FakeClock()
+        self.sent = []
+
+        async def send(text_data, bytes_data):
+            self.sent.append(text_data if text_data is not None else bytes_data)
+
+        return OutboundQueue(send, max_bytes, grace_seconds, clock=self.clock)
+
+    def drain(self, queue):
+        async def run():
+            queue.start()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            queue.stop()
+
+        asyncio.run(run())
+
+    def test_location_frames_coalesce_per_key(self):
+        queue = self.make_queue()
+        queue.put('a1', coalesce_key='location:1')
+        queue.put(bytes_data=b'b1', coalesce_key='location:2')
+        queue.put('a2', coalesce_key='location:1')
+        self.assertEqual(queue.queued_bytes, 4)
+
+        self.drain(queue)
+        self.assertEqual(self.sent, [b'b1', 'a2'])
+
+    def test_lifecycle_frames_go_ahead_of_coalesced_ones(self):
+        queue = self.make_queue()
+        queue.put('location', coalesce_key='location:1')
+        queue.put('job_accepted')
+        queue.put('job_completed')
+
+        self.drain(queue)
+        self.assertEqual(self.sent, ['job_accepted', 'job_completed', 'location'])
+
+    def test_over_budget_only_after_the_grace_period(self):
+        queue = self.make_queue(max_bytes=10)
+        self.assertTrue(queue.put('x' * 20))
+        self.clock.advance(14)
+        self.assertTrue(queue.put('y'))
+        self.clock.advance(2)
+        self.assertFalse(queue.put('z'))
+
+    def test_dropping_under_budget_resets_the_grace_period(self):
+        queue = self.make_queue(max_bytes=10)
+        self.assertTrue(queue.put('x' * 20, coalesce_key='location:1'))
+        self.clock.advance(14)
+        self.assertTrue(queue.put('x', coalesce_key='location:1'))
+        self.clock.advance(14)
+        self.assertTrue(queue.put('x' * 20, coalesce_key='location:1'))
+        self.clock.advance(14)
+        self.assertTrue(queue.put('y'))
+
+    def test_consumer_closes_with_4008_once_the_grace_is_exceeded(self):
+        consumer = JobNotificationConsumer()
+        consumer.user_id = 1
+        consumer.outbound = self.make_queue(max_bytes=10)
+        consumer.close = mock.AsyncMock()
+
+        async def run():
+            await consumer.send('x' * 20)
+            self.clock.advance(16)
+            await consumer.send('y')
+
+        asyncio.run(run())
+        consumer.close.assert_awaited_once_with(code=4008)
+        self.assertTrue(consumer.outbound.closed)
+        self.assertEqual(consumer.outbound.queued_bytes, 0)
+
+
+class LocationDownsamplerTests(TestCase):
+    """Runs on the real loop clock with short intervals, since held fixes are released by loop timers."""
+
+    INTERVAL = 0.05
+
+    def setUp(self):
+        self.emitted = []
+
+    async def emit(self, event):
+        self.emitted.append(event)
+
+    def fix(self, n, **extra):
+        return {'type': 'location', 'n': n, **extra}
+
+    def test_holds_the_latest_fix_and_releases_it_when_the_interval_ends(self):
+        downsampler = LocationDownsampler(self.INTERVAL, self.emit)
+
+        async def run():
+            await downsampler.offer('job_1', self.fix(1))
+            await downsampler.offer('job_1', self.fix(2, eta=120))
+            await downsampler.offer('job_1', self.fix(3))
+            await downsampler.offer('job_2', self.fix(4))  # keys are independent
+            self.assertEqual(self.emitted, [self.fix(1), self.fix(4)])
+            await asyncio.sleep(self.INTERVAL * 3)
+
+        asyncio.run(run())
+        # The newest fix goes out, keeping the ETA of the one it replaced.
+        self.assertEqual(self.emitted, [self.fix(1), self.fix(4), self.fix(3, eta=120)])
+
+    def test_set_location_rate_changes_the_cadence(self):
+        consumer = JobNotificationConsumer()
+        consumer.user_id = 1
+        consumer.location_stream = LocationDownsampler(30, self.emit)
+
+        async def run():
+            await consumer.location_stream.offer('job_1', self.fix(1))
+            await consumer.location_stream.offer('job_1', self.fix(2))
+            await consumer.handle_set_location_rate({'interval': 'fast'})
+            self.assertEqual(self.emitted, [self.fix(1)])
+
+            # A shorter interval sends what is held straight away.
+            await consumer.handle_set_location_rate({'interval': 0})
+            await asyncio.sleep(0)
+            self.assertEqual(self.emitted, [self.fix(1), self.fix(2)])
+            await consumer.location_stream.offer('job_1', self.fix(3))
+
+        asyncio.run(run())
+        self.assertEqual(self.emitted, [self.fix(1), self.fix(2), self.fix(3)])
+
+    def test_stop_cancels_pending_releases(self):
+        downsampler = LocationDownsampler(self.INTERVAL, self.emit)
+
+        async def run():
+            await downsampler.offer('job_1', self.fix(1))
+            await downsampler.offer('job_1', self.fix(2))
+            downsampler.stop()
+            await asyncio.sleep(self.INTERVAL * 3)
+
+        asyncio.run(run())
+        self.assertEqual(self.emitted, [self.fix(1)])
+        self.assertEqual(downsampler._timers, {})
+
+
+class EtaEngineTests(TestCase):
+    DESTINATION = (13.0, 77.5)
+
+    def make_engine(self):
+        # No smoothing keeps the speed at 20 km/h, so the ETA is 180 s per km of distance.
+        self.clock = FakeClock()
+        return EtaEngine(
+            smoothing=0, initial_speed_kmh=20, min_speed_kmh=5, max_speed_kmh=120, road_factor=1,
+            min_interval=10, min_change_seconds=60, min_change_ratio=0.1, clock=self.clock,
+        )
+
+    def update(self, engine, latitude, job_id=1):
+        return engine.update(job_id, latitude, 77.5, *self.DESTINATION)
+
+    def test_first_fix_sends_an_estimate(self):
+        update = self.update(self.make_engine(), 12.9)
+        self.assertAlmostEqual(update['distance_km'], 0.1 * KM_PER_DEGREE_MERIDIAN, places=2)
+        self.assertAlmostEqual(update['eta_seconds'], 0.1 * KM_PER_DEGREE_MERIDIAN * 180, delta=1)
+        self.assertEqual(update['speed_kmh'], 20)
+
+    def test_updates_are_rate_limited(self):
+        engine = self.make_engine()
+        self.update(engine, 12.9)
+        self.clock.advance(5)
+        self.assertIsNone(self.update(engine, 12.95))  # halved, but too soon
+        self.clock.advance(6)
+        self.assertIsNotNone(self.update(engine, 12.95))
+
+    def test_small_changes_are_suppressed(self):
+        engine = self.make_engine()
+        sent = self.update(engine, 12.9)['eta_seconds']
+        self.clock.advance(30)
+        self.assertIsNone(self.update(engine, 12.901))  # ~20 s earlier: under 60 s and 10%
+        self.clock.advance(30)
+        self.assertLess(self.update(engine, 12.91)['eta_seconds'], sent - 60)
+
+    def test_state_is_dropped_when_the_job_ends(self):
+        customer = CustomUser.objects.create(email='c@x.com')
+        active = ServiceRequest.objects.create(user=customer, status='ACCEPTED')
+        ended_elsewhere = ServiceRequest.objects.create(user=customer, status='CANCELLED')
+        ended_here = ServiceRequest.objects.create(user=customer, status='COMPLETED')
+        for job in (active, ended_elsewhere, ended_here):
+            self.update(eta_engine, 12.9, job_id=job.id)
+            self.addCleanup(eta_engine.forget, job.id)
+
+        forget_job(ended_here.id)
+        self.assertNotIn(ended_here.id, eta_engine.job_ids())
+
+        # The trail flush finds jobs that ended without this process hearing of it.
+        TrailRecorder().flush()
+        self.assertIn(active.id, eta_engine.job_ids())
+        self.assertNotIn(ended_elsewhere.id, eta_engine.job_ids())
+
+
+class GeofenceEngineTests(TestCase):
+    DESTINATION = (13.0, 77.5)
+
+    def setUp(self):
+        self.engine = GeofenceEngine(approach_radius_m=1000, arrival_radius_m=75, arrival_fixes=2)
+
+    def notices(self, latitude, job_id=1):
+        """Notices for a fix `latitude` degrees due south of the destination."""
+        return [notice['notice'] for notice in self.engine.evaluate(job_id, latitude, 77.5, self.DESTINATION)]
+
+    def test_approach_fires_once_on_entering_the_radius(self):
+        self.assertEqual(self.notices(12.98), [])  # ~2.2 km
+        self.assertEqual(self.notices(12.995), ['mechanic_approaching'])  # ~560 m
+        self.assertEqual(self.notices(12.994), [])
+        self.assertEqual(self.notices(12.98), [])
+        self.assertEqual(self.notices(12.995), [])
+
+    def test_arrival_needs_consecutive_fixes_inside_the_radius(self):
+        self.assertEqual(self.notices(12.9995), ['mechanic_approaching'])  # ~56 m
+        self.assertEqual(self.notices(12.999), [])  # ~111 m: the dwell starts over
+        self.assertEqual(self.notices(12.9995), [])
+        self.assertEqual(self.notices(12.9996), ['arrival_suggested'])
+        self.assertEqual(self.notices(13.0), [])
+
+    def test_notices_carry_the_distance(self):
+        notices = self.engine.evaluate(1, 12.995, 77.5, self.DESTINATION)
+        self.assertAlmostEqual(notices[0]['distance_m'], 0.005 * KM_PER_DEGREE_MERIDIAN * 1000, delta=1)
+
+    def test_mark_arrived_and_forget_reset_the_state(self):
+        self.engine.mark_arrived(1)
+        self.assertEqual(self.notices(13.0), [])
+        self.assertEqual(self.notices(13.0), [])
+
+        self.engine.forget(1)
+        self.assertNotIn(1, self.engine.job_ids())
+        self.assertEqual(self.notices(13.0), ['mechanic_approaching'])
+        self.assertEqual(self.notices(13.0), ['arrival_suggested'])
+
+
+class GroupSendManyTests(TestCase):
+    """group_send_many delivers the same on the stock layer and on the opt-in bulk one."""
+
+    def deliver(self, channel_layer):
+        async def run():
+            channels = {}
+            for group in ('user_1', 'user_2', 'user_3'):
+                channels[group] = await channel_layer.new_channel()
+                await channel_layer.group_add(group, channels[group])
+            failures = await group_send_many(channel_layer, ['user_1', 'user_2', 'user_4'], {'type': 'new_job'})
+            received = {}
+            for group, channel in channels.items():
+                try:
+                    received[group] = await asyncio.wait_for(channel_layer.receive(channel), 0.05)
+                except asyncio.TimeoutError:
+                    pass
+            return failures, received
+
+        return asyncio.run(run())
+
+    def test_stock_layer_gets_one_group_send_per_group(self):
+        channel_layer = InMemoryChannelLayer()
+        with mock.patch.object(channel_layer, 'group_send', wraps=channel_layer.group_send) as group_send:
+            failures, received = self.deliver(channel_layer)
+        self.assertEqual(failures, {})
+        self.assertEqual(set(received), {'user_1', 'user_2'})
+        self.assertEqual(group_send.call_count, 3)
+
+    def test_bulk_layer_gets_one_call(self):
+        channel_layer = BulkInMemoryChannelLayer()
+        with mock.patch.object(channel_layer, 'group_send') as group_send:
+            failures, received = self.deliver(channel_layer)
+        self.assertEqual(failures, {})
+        self.assertEqual(set(received), {'user_1', 'user_2'})
+        group_send.assert_not_called()
+
+
+class MechanicDataForUserTests(TestCase):
+
+    def setUp(self):
+        self.mechanic = create_mechanic('m@x.com', 12.9, 77.5)
+
+    def test_serializer_maps_the_stored_position(self):
+        with mock.patch('jobs.views.location_buffer') as location_buffer:
+            data = MechanicDataForUserSerializer(self.mechanic).data
+        location_buffer.get.assert_not_called()
+        self.assertEqual((data['current_latitude'], data['current_longitude']), (12.9, 77.5))
+
+    def test_buffered_position_is_overlaid_when_present(self):
+        with mock.patch('jobs.views.location_buffer') as location_buffer:
+            location_buffer.get.return_value = (12.95, 77.55)
+            data = _mechanic_data_for_user(self.mechanic)
+            location_buffer.get.return_value = None
+            stored = _mechanic_data_for_user(self.mechanic)
+        location_buffer.get.assert_called_with(self.mechanic.user_id)
+        self.assertEqual((data['current_latitude'], data['current_longitude']), (12.95, 77.55))
+        self.assertEqual((stored['current_latitude'], stored['current_longitude']), (12.9, 77.5))
+        self.assertEqual(data['id'], self.mechanic.user_id)
 
-# Create your tests here.
@@ -0,0 +1,234 @@
+import time
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from .eta import eta_engine
+from .flushing import PeriodicFlusher
+from .geofence import geofence_engine
+from .models import JobTrailChunk, ServiceRequest
+
+# Set up a specific logger for this module
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'TRAIL_FLUSH_INTERVAL', 30)
+MAX_POINTS_PER_CHUNK = getattr(settings, 'TRAIL_MAX_POINTS_PER_CHUNK', 512)
+STREAM_PAGE_SIZE = 100  # chunks read per query while streaming
+TRAIL_JOB_STATUSES = ('ACCEPTED', 'ARRIVED')
+
+COORDINATE_SCALE = 100000  # 1e-5 degrees, about 1.1 m
+
+# --- Encoding ---
+#
+# A chunk is self-contained: varint(first fix, unix seconds), then one
+# (d_lat, d_lon, d_seconds) triple of zigzag varints per fix, each relative
+# to the previous fix (the first one relative to 0, 0, first fix). A
+# mechanic moving at city speed with a fix every few seconds costs 3-5 bytes
+# per point. A trail stream is the job's chunks in order, each prefixed with
+# varint(length).
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    result = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return (value << 1) if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def encode_points(points):
+    """Encodes [(latitude, longitude, unix_time), ...] as one chunk."""
+    out = bytearray()
+    start = int(points[0][2])
+    _write_varint(out, start)
+    prev_lat, prev_lon, prev_t = 0, 0, start
+    for latitude, longitude, t in points:
+        lat, lon, t = round(latitude * COORDINATE_SCALE), round(longitude * COORDINATE_SCALE), int(t)
+        _write_varint(out, _zigzag(lat - prev_lat))
+        _write_varint(out, _zigzag(lon - prev_lon))
+        _write_varint(out, _zigzag(t - prev_t))
+        prev_lat, prev_lon, prev_t = lat, lon, t
+    return bytes(out)
+
+
+def decode_points(data):
+    """Inverse of encode_points: [(latitude, longitude, unix_seconds), ...]."""
+    data = bytes(data)
+    t, offset = _read_varint(data, 0)
+    lat = lon = 0
+    points = []
+    while offset < len(data):
+        d_lat, offset = _read_varint(data, offset)
+        d_lon, offset = _read_varint(data, offset)
+        d_t, offset = _read_varint(data, offset)
+        lat += _unzigzag(d_lat)
+        lon += _unzigzag(d_lon)
+        t += _unzigzag(d_t)
+        points.append((lat / COORDINATE_SCALE, lon / COORDINATE_SCALE, t))
+    return points
+
+
+def frame_chunk(data):
+    """One chunk as it appears in a trail stream."""
+    out = bytearray()
+    _write_varint(out, len(data))
+    out += data
+    return bytes(out)
+
+
+def decode_stream(stream):
+    """Every fix in a trail stream, in order."""
+    stream = bytes(stream)
+    points = []
+    offset = 0
+    while offset < len(stream):
+        length, offset = _read_varint(stream, offset)
+        points.extend(decode_points(stream[offset:offset + length]))
+        offset += length
+    return points
+
+
+# --- Recording ---
+
+def _tracked_job_ids():
+    # Jobs with per-job state elsewhere in the location pipeline
+    return eta_engine.job_ids() | geofence_engine.job_ids()
+
+
+def _forget_ended(job_ids):
+    for job_id in job_ids:
+        eta_engine.forget(job_id)
+        geofence_engine.forget(job_id)
+
+
+class TrailRecorder(PeriodicFlusher):
+    """
+    Buffers the fixes of active jobs in memory and appends them to the
+    database as JobTrailChunk rows, one bulk insert per flush rather than
+    one row per fix.
+
+    The same status query also finds jobs that ended without this process
+    hearing of it (the inactivity sweeper, a mechanic with no socket open)
+    and drops their ETA and geofence state.
+    """
+
+    thread_name = 'trail-flusher'
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_points=MAX_POINTS_PER_CHUNK):
+        super().__init__(flush_interval)
+        self.max_points = max_points
+        self._pending = {}  # job_id -> [(latitude, longitude, unix_time), ...]
+
+    def record(self, job_id, latitude, longitude, t=None):
+        point = (float(latitude), float(longitude), time.time() if t is None else t)
+        with self._lock:
+            self._pending.setdefault(job_id, []).append(point)
+        if self._thread is None:
+            self.start()
+
+    def record_many(self, job_id, points):
+        """Buffers a batch of [(latitude, longitude, unix_time), ...] fixes, oldest first."""
+        with self._lock:
+            self._pending.setdefault(job_id, []).extend(
+                (float(latitude), float(longitude), t) for latitude, longitude, t in points
+            )
+        if self._thread is None:
+            self.start()
+
+    def pending_points(self, job_id):
+        """Fixes of `job_id` not yet written, oldest first."""
+        with self._lock:
+            return list(self._pending.get(job_id, ()))
+
+    def flush(self):
+        """Writes every pending fix in one bulk insert. Returns the number of chunks written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        tracked = _tracked_job_ids()
+        if not pending and not tracked:
+            return 0
+        try:
+            # Fixes can trail in after a job ended; those are dropped.
+            active = set(ServiceRequest.objects.filter(
+                id__in=list(tracked.union(pending)), status__in=TRAIL_JOB_STATUSES
+            ).values_list('id', flat=True))
+            _forget_ended(tracked - active)
+            if not pending:
+                return 0
+            chunks = []
+            for job_id, points in pending.items():
+                if job_id not in active:
+                    continue
+                points.sort(key=lambda point: point[2])  # uploaded batches can predate live fixes
+                for i in range(0, len(points), self.max_points):
+                    run = points[i:i + self.max_points]
+                    chunks.append(JobTrailChunk(
+                        service_request_id=job_id,
+                        started_at=datetime.fromtimestamp(int(run[0][2]), tz=dt_timezone.utc),
+                        point_count=len(run),
+                        data=encode_points(run),
+                    ))
+            JobTrailChunk.objects.bulk_create(chunks, batch_size=500)
+            logger.debug(f"[TRAIL] Wrote {len(chunks)} trail chunks for {len(active)} jobs.")
+            return len(chunks)
+        except Exception as e:
+            logger.error(f"[TRAIL] Failed to write trails of {len(pending)} jobs: {e}", exc_info=True)
+            with self._lock:
+                for job_id, points in pending.items():
+                    self._pending[job_id] = points + self._pending.get(job_id, [])
+            return 0
+
+
+@database_sync_to_async
+def _trail_page(job_id, after=None):
+    """The next page of a job's stored chunks after (started_at, id): [(started_at, id, data), ...]."""
+    chunks = JobTrailChunk.objects.filter(service_request_id=job_id)
+    if after is not None:
+        started_at, chunk_id = after
+        chunks = chunks.filter(Q(started_at__gt=started_at) | Q(started_at=started_at, id__gt=chunk_id))
+    return list(chunks.order_by('started_at', 'id').values_list('started_at', 'id', 'data')[:STREAM_PAGE_SIZE])
+
+
+async def iter_trail_stream(job_id):
+    """
+    The encoded trail of a job as an async stream of framed chunks: stored
+    chunks first, a page per query, then the fixes this process has not
+    flushed yet. Async so that ASGI servers send it as it is read instead
+    of buffering the whole trail.
+    """
+    after = None
+    while True:
+        page = await _trail_page(job_id, after)
+        for _, _, data in page:
+            yield frame_chunk(bytes(data))
+        if len(page) < STREAM_PAGE_SIZE:
+            break
+        after = page[-1][:2]
+    pending = trail_recorder.pending_points(job_id)
+    if pending:
+        yield frame_chunk(encode_points(pending))
+
+
+# Process-wide recorder fed by JobNotificationConsumer.
+trail_recorder = TrailRecorder()
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import UpdateMechanicStatusView,GetBasicNeedsView,CreateServiceRequestView,AcceptServiceRequestView,CancelServiceRequestView,CompleteServiceRequestView,SyncActiveJobView,MechanicArrivedView
+from .views import UpdateMechanicStatusView,GetBasicNeedsView,CreateServiceRequestView,AcceptServiceRequestView,CancelServiceRequestView,CompleteServiceRequestView,SyncActiveJobView,MechanicArrivedView,DispatchMetricsView,DispatchTimelineView,JobTrailView,BulkLocationUploadView
 
 
 urlpatterns = [
@@ -11,5 +11,9 @@ urlpatterns = [
    path('CompleteServiceRequest/<int:request_id>/', CompleteServiceRequestView.as_view(), name='CompleteServiceRequest'),
    path('SyncActiveJob/', SyncActiveJobView.as_view(), name='SyncActiveJob'),
    path('MechanicArrived/<int:request_id>/', MechanicArrivedView.as_view(), name='MechanicArrived'),
+   path('DispatchMetrics/', DispatchMetricsView.as_view(), name='DispatchMetrics'),
+   path('DispatchTimeline/<int:request_id>/', DispatchTimelineView.as_view(), name='DispatchTimeline'),
+   path('JobTrail/<int:request_id>/', JobTrailView.as_view(), name='JobTrail'),
+   path('BulkLocationUpload/', BulkLocationUploadView.as_view(), name='BulkLocationUpload'),
 
 ]
\ No newline at end of file
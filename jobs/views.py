@@ -1,11 +1,17 @@
-import threading
+import hmac
+import time
+
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from core.authentication import CookieJWTAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import ServiceRequest
+from .models import ServiceRequest, DispatchAttempt
+from .trail import TRAIL_JOB_STATUSES, iter_trail_stream
+from .ingest import forget_job, ingest_location_batch
+from .geofence import geofence_engine
+from .location_buffer import location_buffer
 from users.models import Mechanic
 from core.cache import cache_per_user
 from django.utils.decorators import method_decorator
@@ -13,13 +19,29 @@ from django.utils.decorators import method_decorator
 from django.db import transaction
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .tasks import find_and_notify_mechanics_thread_task
+from .dispatcher import dispatcher
+from .fanout import job_group, send_session_state
+from .metrics import registry as metrics_registry
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 
 from .serializers import MechanicDataForUserSerializer,JobDetailsForMechanicSerializer
 import logging
 logger = logging.getLogger(__name__)
 
 
+def _mechanic_data_for_user(mechanic_profile):
+    """
+    The mechanic details shown to a customer, with the position held in this
+    process's location buffer, which is ahead of the DB by up to one flush interval.
+    """
+    mechanic_data = MechanicDataForUserSerializer(mechanic_profile).data
+    latest = location_buffer.get(mechanic_profile.user_id)
+    if latest is not None:
+        mechanic_data['current_latitude'], mechanic_data['current_longitude'] = latest
+    return mechanic_data
+
+
 # View to update the status of a mechanic.
 class UpdateMechanicStatusView(APIView):
     """
@@ -119,14 +141,8 @@ class CreateServiceRequestView(APIView):
             vehical_details=vehical_details
         )
 
-        # Start a new thread to run the task
-        thread = threading.Thread(
-            target=find_and_notify_mechanics_thread_task,
-            args=(service_request.id,) # The comma is important for a single-item tuple
-        )
-        # Setting daemon to True ensures the thread won't block the main process from exiting
-        thread.daemon = True 
-        thread.start()
+        # Hand the job to the process-wide dispatcher loop (no thread per request)
+        dispatcher.submit(service_request.id)
 
         return Response({
             'message': 'Request sent successfully. We are finding a mechanic for you.',
@@ -149,8 +165,18 @@ class AcceptServiceRequestView(APIView):
                     sr_locked.assigned_mechanic = mechanic_profile
                     sr_locked.save()
 
-                    serializer = MechanicDataForUserSerializer(mechanic_profile)
-                    mechanic_data = serializer.data
+                    # Wake the waiting broadcast so 'job taken' goes out immediately
+                    transaction.on_commit(
+                        lambda: dispatcher.publish_job_state(sr_locked.id, 'ACCEPTED', request.user.id)
+                    )
+                    # The mechanic's sockets start forwarding location to this customer
+                    transaction.on_commit(
+                        lambda: send_session_state(
+                            request.user.id, job_id=sr_locked.id, job_status='ACCEPTED', customer_id=sr_locked.user_id
+                        )
+                    )
+
+                    mechanic_data = _mechanic_data_for_user(mechanic_profile)
 
                     channel_layer = get_channel_layer()
                     async_to_sync(channel_layer.group_send)(
@@ -209,37 +235,44 @@ class CancelServiceRequestView(APIView):
                 service_request.cancellation_reason = cancellation_reason
                 service_request.save()
 
+                # Stop any broadcast still offering this job
+                transaction.on_commit(
+                    lambda: dispatcher.publish_job_state(service_request.id, 'CANCELLED')
+                )
+                transaction.on_commit(lambda: forget_job(service_request.id))
+
                 channel_layer = get_channel_layer()
                 canceller_role = "Unknown"
 
                 if is_mechanic:
                     canceller_role = "Mechanic"
+                    transaction.on_commit(
+                        lambda: send_session_state(request.user.id, job_id=service_request.id, job_status='CANCELLED')
+                    )
                     mechanic_profile = service_request.assigned_mechanic
                     mechanic_profile.status = 'ONLINE'
                     mechanic_profile.save()
-                    
-                    target_room = f'user_{original_customer_id}'
                     message = f"The mechanic has cancelled job request {service_request.id}."
+
+                elif is_customer:
+                    canceller_role = "Customer"
+                    transaction.on_commit(
+                        lambda: send_session_state(request.user.id, job_id=service_request.id, job_status='CANCELLED')
+                    )
+                    message = f"The customer has cancelled job request {service_request.id}."
+
+                # Everyone following the job, the canceller's other devices included
+                if original_mechanic_id:
                     if cancellation_reason:
                         message += f" Reason: {cancellation_reason}"
-                    
                     async_to_sync(channel_layer.group_send)(
-                        target_room,
-                        {'type': 'job_cancelled_notification', 'job_id': service_request.id, 'message': message}
+                        job_group(service_request.id),
+                        {
+                            'type': 'job_cancelled_notification',
+                            'job_id': service_request.id,
+                            'message': message,
+                        }
                     )
-
-                elif is_customer:
-                    canceller_role = "Customer"
-                    if original_mechanic_id:
-                        target_room = f'user_{original_mechanic_id}'
-                        message = f"The customer has cancelled job request {service_request.id}."
-                        if cancellation_reason:
-                            message += f" Reason: {cancellation_reason}"
-
-                        async_to_sync(channel_layer.group_send)(
-                            target_room,
-                            {'type': 'job_cancelled_notification', 'job_id': service_request.id, 'message': message}
-                        )
                 
                 # Log the successful cancellation
                 logger.info(
@@ -283,15 +316,16 @@ class MechanicArrivedView(APIView):
                 
                 service_request.status = 'ARRIVED'
                 service_request.save()
+                transaction.on_commit(lambda: geofence_engine.mark_arrived(service_request.id))
 
-                # Notify the Customer
+                # Notify the Customer (and any observers of the job)
                 channel_layer = get_channel_layer()
                 async_to_sync(channel_layer.group_send)(
-                    f"user_{service_request.user.id}",
+                    job_group(service_request.id),
                     {
                         'type': 'mechanic_arrived_notification',
                         'job_id': service_request.id,
-                        'message': "Mechanic has arrived."
+                        'message': "Mechanic has arrived.",
                     }
                 )
 
@@ -324,6 +358,10 @@ class CompleteServiceRequestView(APIView):
                 service_request.price = price
                 service_request.status = 'COMPLETED'
                 service_request.save()
+                transaction.on_commit(
+                    lambda: send_session_state(request.user.id, job_id=service_request.id, job_status='COMPLETED')
+                )
+                transaction.on_commit(lambda: forget_job(service_request.id))
 
                 # Update mechanic's status to ONLINE
                 mechanic_profile = service_request.assigned_mechanic
@@ -333,12 +371,12 @@ class CompleteServiceRequestView(APIView):
                 # Broadcast notification
                 channel_layer = get_channel_layer()
                 async_to_sync(channel_layer.group_send)(
-                    f"user_{service_request.user.id}",
+                    job_group(service_request.id),
                     {
                         'type': 'job_completed_notification',
                         'job_id': service_request.id,
                         'price': price,
-                        'message': f"Your service request {service_request.id} has been completed. Total Amount: {price}"
+                        'message': f"Your service request {service_request.id} has been completed. Total Amount: {price}",
                     }
                 )
 
@@ -377,8 +415,7 @@ class SyncActiveJobView(APIView):
             else:
                 if active_request.assigned_mechanic:
                     mechanic_profile = active_request.assigned_mechanic
-                    serializer = MechanicDataForUserSerializer(mechanic_profile)
-                    mechanic_data = serializer.data
+                    mechanic_data = _mechanic_data_for_user(mechanic_profile)
                     
                     # Optional: Add current job status/price to response so UI knows to show "Arrived" state
                     mechanic_data['job_status'] = active_request.status 
@@ -393,4 +430,138 @@ class SyncActiveJobView(APIView):
                     }
                     return Response(pending_data, status=status.HTTP_200_OK)
         else:
-            return Response({'message': 'No active job found.'}, status=status.HTTP_200_OK)
\ No newline at end of file
+            return Response({'message': 'No active job found.'}, status=status.HTTP_200_OK)
+
+
+class DispatchMetricsView(APIView):
+    """
+    Dispatch latency histograms for this process, in the Prometheus text format.
+    Scrapers authenticate with the X-Metrics-Token header (settings.DISPATCH_METRICS_TOKEN).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        expected = getattr(settings, 'DISPATCH_METRICS_TOKEN', '')
+        provided = request.headers.get('X-Metrics-Token', '')
+        if not expected or not hmac.compare_digest(provided, expected):
+            return Response({'error': 'Invalid metrics token.'}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class DispatchTimelineView(APIView):
+    """
+    Stage-by-stage dispatch timeline of one job. Only accessible by admin users.
+    Served from memory while this process is dispatching the job, otherwise
+    from DispatchAttempt. The stored timeline is only written when the
+    attempt finishes, so it is empty while another process is dispatching.
+    """
+    authentication_classes = [CookieJWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, request_id):
+        try:
+            dispatch_attempt = DispatchAttempt.objects.select_related('service_request').get(service_request_id=request_id)
+        except DispatchAttempt.DoesNotExist:
+            return Response({'error': 'No dispatch found for this service request.'}, status=status.HTTP_404_NOT_FOUND)
+
+        job = dispatcher.get_job(request_id)
+        return Response({
+            'job_id': request_id,
+            'status': dispatch_attempt.service_request.status,
+            'attempt': job.attempt if job else dispatch_attempt.attempt,
+            'wave': job.wave if job else dispatch_attempt.wave,
+            'is_finished': dispatch_attempt.is_finished,
+            'owner': dispatch_attempt.owner,
+            'timeline': list(job.timeline) if job else dispatch_attempt.timeline,
+        }, status=status.HTTP_200_OK)
+
+
+class JobTrailView(APIView):
+    """
+    Streams the mechanic's recorded route for a job as delta/varint-encoded
+    chunks (format in jobs.trail). Accessible by the job's customer, its
+    assigned mechanic and admin users.
+    """
+    authentication_classes = [CookieJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, request_id):
+        service_request = ServiceRequest.objects.filter(id=request_id).values(
+            'user_id', 'assigned_mechanic__user_id'
+        ).first()
+        if service_request is None:
+            return Response({'error': 'Service request not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        is_participant = request.user.id in (service_request['user_id'], service_request['assigned_mechanic__user_id'])
+        if not is_participant and not request.user.is_staff:
+            return Response({'error': 'You are not authorized to view this trail.'}, status=status.HTTP_403_FORBIDDEN)
+
+        response = StreamingHttpResponse(iter_trail_stream(request_id), content_type='application/octet-stream')
+        response['X-Trail-Format'] = 'varint-delta-v1'
+        return response
+
+
+class BulkLocationUploadView(APIView):
+    """
+    Accepts the GPS fixes a backgrounded mechanic app buffered while its
+    socket was down, in one request:
+    {"job_id": 12, "points": [{"latitude": .., "longitude": .., "timestamp": <unix seconds>}, ...]}
+    The fixes go through the same ingestion path as live location frames
+    (see jobs.ingest.ingest_location_batch).
+    """
+    permission_classes = [IsAuthenticated]
+    max_points = getattr(settings, 'LOCATION_UPLOAD_MAX_POINTS', 1000)
+
+    def post(self, request):
+        raw_points = request.data.get('points')
+        if not isinstance(raw_points, list) or not raw_points:
+            return Response({'error': 'points must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(raw_points) > self.max_points:
+            return Response({'error': f'At most {self.max_points} points per upload.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        mechanic = Mechanic.objects.filter(user_id=request.user.id).values_list('id', 'status').first()
+        if mechanic is None:
+            return Response({'error': 'Only mechanics can upload locations.'}, status=status.HTTP_403_FORBIDDEN)
+        mechanic_id, mechanic_status = mechanic
+
+        now = time.time()
+        points = []
+        for point in raw_points:
+            try:
+                latitude, longitude = float(point['latitude']), float(point['longitude'])
+                timestamp = float(point['timestamp'])
+            except (TypeError, ValueError, KeyError):
+                continue
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180 and timestamp <= now + 60:
+                points.append((latitude, longitude, min(timestamp, now)))
+        if not points:
+            return Response({'error': 'No valid points.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the mechanic's own active job gets the trail and the customer update.
+        job_id, destination = request.data.get('job_id'), None
+        if job_id is not None:
+            try:
+                job_id = int(job_id)
+            except (TypeError, ValueError):
+                return Response({'error': 'job_id must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+            job = None
+            if mechanic_status == Mechanic.StatusChoices.WORKING:
+                job = ServiceRequest.objects.filter(
+                    id=job_id, assigned_mechanic_id=mechanic_id, status__in=TRAIL_JOB_STATUSES
+                ).values_list('id', 'latitude', 'longitude').first()
+            if job is None:
+                logger.warning(f"Bulk location upload from user {request.user.id} for job {job_id} they are not working on.")
+                job_id = None
+            else:
+                job_id = job[0]
+                destination = job[1:] if None not in job[1:] else None
+
+        kept = ingest_location_batch(request.user.id, points, job_id, destination)
+        logger.info(f"Bulk location upload from user {request.user.id}: {len(kept)}/{len(raw_points)} points kept, job {job_id}.")
+        return Response({
+            'received': len(raw_points),
+            'invalid': len(raw_points) - len(points),
+            'accepted': len(kept),
+            'job_id': job_id,
+        }, status=status.HTTP_200_OK)